@@ -1,7 +1,11 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from models import db, User, Device, ActivityLog, Booking
-from utils.logging import log_event
+from models import db, User, Device, ActivityLog, Booking, Alert, ActivityLogArchive, BookingArchive
+from utils.logging import log_event, flush as flush_logs, stats as log_stats
+from utils import occupancy, counters, lifecycle, coalesce, pubsub, archive, dbpool, emailer, identity, passwords, resume, similarity, throttle
+from utils.pagination import keyset_page_chain, page_limit
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
 import pytz
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -15,23 +19,26 @@ def dashboard():
     if not current_user.is_admin:
         return "Access denied", 403
 
-    # Pending users & devices
+    # Pending users & devices (owner loaded in the same query for the tables)
     users = User.query.filter_by(is_approved=False).all()
-    pending_devices = Device.query.filter(Device.status != "Approved").all()
-    approved_devices = Device.query.filter_by(status="Approved") \
+    pending_devices = Device.query.options(joinedload(Device.user)) \
+                                  .filter(Device.status.in_(["Pending", "Rejected"])).all()
+    approved_devices = Device.query.options(joinedload(Device.user)) \
+                                   .filter_by(status="Approved") \
                                    .order_by(Device.user_id, Device.id).all()
 
-    honeypot_count = ActivityLog.query.filter_by(event="honeypot_triggered").count()
-    resume_failures = ActivityLog.query.filter_by(event="resume_auth_failed").count()
-    idle_pauses = ActivityLog.query.filter_by(event="session_pause").count()
+    # Security counters come from the per-day rollup, not ActivityLog scans
+    trends = counters.summary(["honeypot_triggered", "resume_auth_failed", "session_pause"])
 
     # Top 5 risky devices
-    risky_devices = Device.query.order_by(Device.risk_score.desc()).limit(5).all()
+    risky_devices = Device.query.options(joinedload(Device.user)) \
+                                .order_by(Device.risk_score.desc()).limit(5).all()
 
     analytics = {
-        "honeypot": honeypot_count,
-        "resume_failures": resume_failures,
-        "idle_pauses": idle_pauses,
+        "honeypot": trends["honeypot_triggered"]["total"],
+        "resume_failures": trends["resume_auth_failed"]["total"],
+        "idle_pauses": trends["session_pause"]["total"],
+        "trends": trends,
         "risky_devices": risky_devices
     }
 
@@ -57,6 +64,7 @@ def approve_user(user_id):
     user = User.query.get_or_404(user_id)
     user.is_approved = True
     db.session.commit()
+    identity.invalidate_user(user.id)
 
     log_event("user_approved", user_id=user.id, details=f"Admin {current_user.username} approved user")
     flash(f"User '{user.username}' approved.", "success")
@@ -75,6 +83,8 @@ def reject_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    identity.invalidate_user(user_id)
+    similarity.forget_user(user_id)
 
     flash("User rejected & removed.", "danger")
     return redirect(url_for('admin.dashboard'))
@@ -91,18 +101,27 @@ def nuke_user(user_id):
 
     user = User.query.get_or_404(user_id)
 
-    # delete logs
+    # delete logs (write out anything still buffered for this user first)
+    flush_logs()
     ActivityLog.query.filter_by(user_id=user.id).delete()
+    ActivityLogArchive.query.filter_by(user_id=user.id).delete()
 
     # delete bookings
     Booking.query.filter_by(user_id=user.id).delete()
+    BookingArchive.query.filter_by(user_id=user.id).delete()
 
-    # delete devices
+    # delete alerts (bulk deletes skip the ORM cascade), then devices
+    device_ids = db.session.query(Device.id).filter_by(user_id=user.id)
+    Alert.query.filter(db.or_(Alert.user_id == user.id, Alert.device_id.in_(device_ids))) \
+               .delete(synchronize_session=False)
     Device.query.filter_by(user_id=user.id).delete()
 
     # delete user
     db.session.delete(user)
     db.session.commit()
+    identity.invalidate_user(user_id)
+    similarity.forget_user(user_id)
+    occupancy.remove_user(user_id)
 
     flash("User, devices, bookings & logs permanently removed.", "danger")
     return redirect(url_for("admin.dashboard"))
@@ -157,36 +176,49 @@ def device_logs(device_id):
     ist = pytz.timezone("Asia/Kolkata")
 
     device = Device.query.get_or_404(device_id)
-    logs = ActivityLog.query.filter_by(device_id=device_id).order_by(ActivityLog.created_at.desc()).all()
 
-    # Convert timestamps to IST
-    for log in logs:
-        if log.created_at:
-            log.local_time = log.created_at.astimezone(ist)
-
-    # Alerts (keep your logic)
-    from datetime import datetime, timedelta
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-
-    alerts = []
-
-    fails = ActivityLog.query.filter(
-        ActivityLog.device_id == device_id,
-        ActivityLog.event == "resume_auth_failed",
-        ActivityLog.created_at >= one_hour_ago
-    ).count()
-    if fails >= 3:
-        alerts.append({"text": f"{fails} failed resume attempts last hour."})
-
-    pauses = ActivityLog.query.filter(
-        ActivityLog.device_id == device_id,
-        ActivityLog.event == "session_pause",
-        ActivityLog.created_at >= one_hour_ago
-    ).count()
-    if pauses >= 5:
-        alerts.append({"text": f"{pauses} pauses last hour."})
+    # ?history=1 reads on into activity_log_archive once the live rows run out
+    history = request.args.get("history") == "1"
+    sources = [(ActivityLog.query.filter_by(device_id=device_id), ActivityLog.created_at, ActivityLog.id)]
+    if history:
+        sources.append((ActivityLogArchive.query.filter_by(device_id=device_id),
+                        ActivityLogArchive.created_at, ActivityLogArchive.id))
+    logs, next_cursor = keyset_page_chain(
+        sources,
+        cursor=request.args.get("cursor"),
+        limit=page_limit(request.args.get("limit"))
+    )
 
-    return render_template("device_logs.html", device=device, logs=logs, alerts=alerts)
+    # Convert timestamps (stored as naive UTC) to IST: one offset lookup per page
+    offset = ist.utcoffset(datetime.utcnow())
+    for log in logs:
+        log.local_time = log.created_at + offset if log.created_at else None
+
+    if request.args.get("format") == "json":
+        return jsonify({
+            "logs": [{
+                "id": l.id,
+                "time": l.local_time.isoformat() if l.local_time else None,
+                "event": l.event,
+                "details": l.details,
+                "ip_address": l.ip_address,
+                "occurrences": l.occurrences or 1
+            } for l in logs],
+            "next_cursor": next_cursor,
+            "history": history
+        })
+
+    # Alerts are raised in real time by utils/anomaly.py as events are logged
+    since = datetime.utcnow() - timedelta(hours=24)
+    alerts = Alert.query.filter(
+        Alert.device_id == device_id,
+        Alert.created_at >= since
+    ).order_by(Alert.created_at.desc()).limit(20).all()
+    for a in alerts:
+        a.local_time = pytz.utc.localize(a.created_at).astimezone(ist)
+
+    return render_template("device_logs.html", device=device, logs=logs, alerts=alerts,
+                           next_cursor=next_cursor, history=history)
 
 
 # ------------------------------------------------------------
@@ -201,8 +233,34 @@ def delete_device_admin(device_id):
     device = Device.query.get_or_404(device_id)
     db.session.delete(device)
     db.session.commit()
+    similarity.remove(device_id)
 
     flash("Device deleted.", "success")
     return redirect(url_for("admin.dashboard"))
 
 
+
+
+# ------------------------------------------------------------
+# RUNTIME METRICS (background workers)
+# ------------------------------------------------------------
+@admin_bp.route("/api/metrics")
+@login_required
+def metrics():
+    if not current_user.is_admin:
+        return jsonify({"error": "Forbidden"}), 403
+
+    return jsonify({
+        "activity_log": log_stats(),
+        "coalesced_pending": coalesce.pending(),
+        "booking_lifecycle": lifecycle.stats(),
+        "archive": archive.stats(),
+        "db_pool": dbpool.stats(),
+        "mail": emailer.stats(),
+        "identity_cache": identity.stats(),
+        "password_hashing": passwords.stats(),
+        "resume_pins": resume.stats(),
+        "login_throttle": throttle.stats(),
+        "device_match": similarity.stats(),
+        "live_subscribers": pubsub.subscriber_count()
+    }), 200
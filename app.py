@@ -1,4 +1,5 @@
-from flask import Flask, render_template, redirect, url_for
+from flask import Flask, render_template, redirect, url_for, current_app
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, current_user
 from models import db, User
 from auth import auth_bp
@@ -6,38 +7,31 @@ from booking import booking_bp
 from compliance import compliance_bp
 from admin import admin_bp
 from byod import byod_bp
-from werkzeug.security import generate_password_hash
+from migrations import upgrade
+from utils import floors, lifecycle, dbpool, emailer, identity, passwords, risk, throttle
+from config import Config, engine_options
+from sqlalchemy.engine import make_url
+import click
 import os
 import socket
 
-# ---------------------------------------------------
-# APP INITIALIZATION
-# ---------------------------------------------------
-app = Flask(__name__, static_folder='static', static_url_path='/static')
-app.config['SECRET_KEY'] = 'supersecretkey'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///deskhop.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Database setup
-db.init_app(app)
-
-# Login manager setup
+# Login manager (bound to each app in create_app)
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = "auth.login"
 
+
 # ---------------------------------------------------
 # USER LOADER
 # ---------------------------------------------------
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # served from the per-process identity cache; see utils/identity.py
+    return identity.get_user(int(user_id), ttl=current_app.config.get("IDENTITY_CACHE_TTL", identity.TTL))
 
 
 # ---------------------------------------------------
 # ROOT ROUTE
 # ---------------------------------------------------
-@app.route("/")
 def home():
     if current_user.is_authenticated:
         if current_user.is_admin:
@@ -47,35 +41,135 @@ def home():
 
 
 # ---------------------------------------------------
-# BLUEPRINT REGISTRATION
+# APP FACTORY
 # ---------------------------------------------------
-app.register_blueprint(auth_bp, url_prefix="/auth")
-app.register_blueprint(admin_bp, url_prefix="/admin")
-app.register_blueprint(booking_bp, url_prefix="/booking")
-app.register_blueprint(byod_bp, url_prefix="/device")
-app.register_blueprint(compliance_bp, url_prefix="/compliance")
+def create_app(config=None):
+    """
+    Build a configured app. `config` is a dict or config object applied over
+    config.Config (which reads the environment).
+    Cheap enough to run in every worker: no migrations, no network lookups.
+    """
+    app = Flask(__name__, static_folder='static', static_url_path='/static')
+    app.config.from_object(Config)   # DATABASE_URL, pool sizes, ... from the environment
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+
+    # Behind N reverse proxies, take client IP / scheme / host from their X-Forwarded-* headers
+    proxies = app.config.get("TRUSTED_PROXIES") or 0
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    # Database setup (SQLite pragmas / pool metrics hooked on the engine)
+    db.init_app(app)
+    with app.app_context():
+        dbpool.install(db.engine, app.config)
+
+    login_manager.init_app(app)
+
+    # Password hashing scheme/cost and its worker pool
+    passwords.configure(app.config)
+
+    # Login throttle state (in process, or shared through THROTTLE_REDIS_URL)
+    throttle.configure(app.config)
+
+    app.add_url_rule("/", "home", home)
+
+    # Blueprint registration
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    app.register_blueprint(booking_bp, url_prefix="/booking")
+    app.register_blueprint(byod_bp, url_prefix="/device")
+    app.register_blueprint(compliance_bp, url_prefix="/compliance")
+
+    # Floor plans are loaded once and served from memory
+    floors.init(os.path.join(app.root_path, 'static', 'floors'))
+
+    # No-show release / session auto-complete sweeper (starts with the first request)
+    lifecycle.init(app)
+
+    # Outbound mail worker (sends what is left in the queue after a restart)
+    emailer.init(app)
+
+    register_commands(app)
+    return app
+
+
+# ---------------------------------------------------
+# CLI:  flask --app app init-db | create-admin
+# ---------------------------------------------------
+def create_admin(username, email, password):
+    """Create an approved admin; returns (user, created)."""
+    admin = User.query.filter_by(username=username).first()
+    if admin:
+        return admin, False
+    admin = User(
+        username=username,
+        email=email,
+        password_hash=passwords.hash_password(password),
+        is_admin=True,
+        is_verified=True,
+        is_approved=True
+    )
+    db.session.add(admin)
+    db.session.commit()
+    return admin, True
+
+
+def register_commands(app):
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create tables and apply pending migrations."""
+        applied = upgrade()
+        print(f"✅ Database ready ({len(applied)} migrations applied)")
+
+    @app.cli.command("create-admin")
+    @click.option("--username", default="admin", show_default=True)
+    @click.option("--email", default="admin@deskhop.local", show_default=True)
+    @click.password_option()
+    def create_admin_command(username, email, password):
+        """Create an admin account (skipped if the username exists)."""
+        _, created = create_admin(username, email, password)
+        if created:
+            print(f"✅ Admin created: username='{username}'")
+        else:
+            print(f"✅ User '{username}' already exists!")
+
+    @app.cli.command("rescore-devices")
+    def rescore_devices_command():
+        """Recompute every device's risk score (run after changing RISK_WEIGHTS)."""
+        result = risk.rescore_all(app.config)
+        print(f"✅ Rescored {result['devices']} devices in {result['seconds']}s "
+              f"({result['changed']} changed)")
+
+
+def _lan_ip():
+    # Routing lookup only (UDP connect sends nothing), so no DNS wait
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("10.255.255.255", 1))
+        return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        s.close()
 
 
 # ---------------------------------------------------
-# DB INIT & DEFAULT ADMIN
+# DEV SERVER: DB INIT & DEFAULT ADMIN
 # ---------------------------------------------------
+# Production runs wsgi.py under gunicorn/waitress instead.
 if __name__ == "__main__":
+    app = create_app()
+
     with app.app_context():
-        db.create_all()
+        upgrade()
 
         # Default admin auto-setup
-        admin = User.query.filter_by(username="admin").first()
-        if not admin:
-            admin = User(
-                username="admin",
-                email="admin@deskhop.local",
-                password_hash=generate_password_hash("admin123"),
-                is_admin=True,
-                is_verified=True,
-                is_approved=True
-            )
-            db.session.add(admin)
-            db.session.commit()
+        _, created = create_admin("admin", "admin@deskhop.local", "admin123")
+        if created:
             print("✅ Default admin created: username='admin', password='admin123'")
         else:
             print("✅ Admin user already exists!")
@@ -90,12 +184,10 @@ if __name__ == "__main__":
             print("\n✅ No pending user approvals.")
 
     # Show LAN IP for mobile access
-    hostname = socket.gethostname()
-    ip_address = socket.gethostbyname(hostname)
     print("\n📱 Access this site from your phone:")
-    print(f"👉 http://{ip_address}:5000\n")
+    print(f"👉 http://{_lan_ip()}:5000\n")
 
-    print("📁 Database path:", os.path.abspath("deskhop.db"))
+    print("📁 Database:", make_url(app.config['SQLALCHEMY_DATABASE_URI']).render_as_string(hide_password=True))
 
     # Run server on LAN
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=True, threaded=True)
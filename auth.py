@@ -1,11 +1,11 @@
 # auth.py
-from flask import Blueprint, render_template, redirect, url_for, request, flash, session
+from flask import Blueprint, render_template, redirect, url_for, request, flash, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer
 from models import db, User, Device
 from utils.logging import log_event
 from utils.emailer import send_verification_email
+from utils import identity, passwords, risk, similarity, throttle
 from datetime import datetime
 
 auth_bp = Blueprint("auth", __name__)
@@ -48,10 +48,16 @@ def register():
             flash("Email already registered.", "danger")
             return redirect(url_for("auth.register"))
 
+        try:
+            password_hash = passwords.hash_password(password)
+        except passwords.HasherBusy:
+            flash("Server busy, please try again.", "warning")
+            return redirect(url_for("auth.register"))
+
         new_user = User(
             username=username,
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=password_hash,
             is_admin=False,
             is_verified=False,
             is_approved=False
@@ -59,13 +65,13 @@ def register():
         db.session.add(new_user)
         db.session.commit()
 
-        # send verification email
+        # queue verification email (sent by the background mail worker)
         token = generate_token(new_user.id)
         verify_url = url_for("auth.verify_email", token=token, _external=True)
         try:
             send_verification_email(email, verify_url)
         except Exception:
-            # don't fail registration if email sending fails locally
+            # don't fail registration if the mail can't even be queued
             log_event("email_send_failed", user_id=new_user.id)
 
         flash("Registered! Check your email to verify your account.", "info")
@@ -91,6 +97,7 @@ def verify_email(token):
 
     user.is_verified = True
     db.session.commit()
+    identity.invalidate_user(user.id)
 
     flash("Email verified! Wait for admin approval.", "success")
     return redirect(url_for("auth.login"))
@@ -113,11 +120,30 @@ def login():
         flash("Missing username or password.", "danger")
         return redirect(url_for("auth.login"))
 
+    # per (IP, username) / per-IP backoff, checked before any query or hash
+    ip = request.remote_addr
+    wait = throttle.check(ip, username)
+    if wait:
+        retry = int(wait) + 1
+        flash(f"Too many failed attempts. Try again in {retry} seconds.", "danger")
+        return render_template("login.html"), 429, {"Retry-After": str(retry)}
+
     user = User.query.filter_by(username=username).first()
-    if not user or not check_password_hash(user.password_hash, password):
+    try:
+        # rehashes in place when the configured scheme/cost changed
+        ok = user is not None and passwords.verify_and_update(user, password)
+    except passwords.HasherBusy:
+        flash("Server busy, please try again.", "warning")
+        return redirect(url_for("auth.login"))
+    if not ok:
+        throttle.failure(ip, username)
         log_event("login_failed", details=f"Invalid login for {username}")
         flash("Invalid credentials.", "danger")
         return redirect(url_for("auth.login"))
+    throttle.success(ip, username)
+    if db.session.is_modified(user):
+        db.session.commit()
+        identity.invalidate_user(user.id)
 
     # email verification + account approval checks
     if not user.is_verified:
@@ -145,6 +171,18 @@ def login():
     device_cpuThreads = request.form.get("device_cpuThreads")
     device_screen = request.form.get("device_screen")
     device_timezone = request.form.get("device_timezone")
+    device_hints = {
+        "userAgent": device_userAgent,
+        "platform": device_platform,
+        "cpuThreads": device_cpuThreads,
+        "screen": device_screen,
+        "timezone": device_timezone,
+        "touch": request.form.get("device_touch"),
+        "deviceMemory": request.form.get("device_memory"),
+        "connection": request.form.get("device_connection"),
+        "battery": request.form.get("device_battery"),
+        "charging": request.form.get("device_charging"),
+    }
 
     if not device_fp:
         # If your client doesn't send fingerprint, deny and request proper client
@@ -153,6 +191,19 @@ def login():
 
     # try to find device by fingerprint for this user
     device = Device.query.filter_by(user_id=user.id, fingerprint=device_fp).first()
+    device_sig = similarity.signature(similarity.features_from_payload(device_hints))
+
+    if not device:
+        # else the user's nearest known device, so drift doesn't pile up Pending records
+        device, score = similarity.find_device(user.id, device_sig, current_app.config)
+        if device is not None and device.status == "Approved":
+            # an unseen fingerprint never logs in as an approved device; it registers as Pending
+            log_event("login_device_lookalike", user_id=user.id, device_id=device.id,
+                      details=f"similarity={score:.2f}")
+            device = None
+        elif device is not None:
+            log_event("login_device_matched", user_id=user.id, device_id=device.id,
+                      details=f"similarity={score:.2f}")
 
     if not device:
         # first time this device logs in -> create pending device record
@@ -165,15 +216,18 @@ def login():
             screen=device_screen,
             timezone=device_timezone,
             fingerprint=device_fp,
+            fp_signature=similarity.encode(device_sig),
             ip_address=request.remote_addr,
-            risk_score=5,
+            risk_score=risk.risk_score_from(device_hints, request.remote_addr, current_app.config),
             status="Pending",
             compliant=False,
             user_id=user.id,
-            created_at=datetime.utcnow()
+            created_at=datetime.utcnow(),
+            **risk.client_hints(device_hints)
         )
         db.session.add(new_device)
         db.session.commit()
+        similarity.add(new_device.id, user.id, device_sig)
 
         login_user(user)
         session["user_id"] = user.id
@@ -1,18 +1,158 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify, flash, current_app, session
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, flash, current_app, session, make_response
 from flask_login import login_required, current_user
-from models import db, Booking, User
-from datetime import datetime
+from models import db, Booking, User, Slot, parse_day, slot_window
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+import hashlib
 import os
+import queue
+import time
+from functools import lru_cache
 from utils.logging import log_event
+from utils import occupancy, coalesce, floors, pubsub, passwords, identity, resume
 
 
 booking_bp = Blueprint('booking', __name__, url_prefix='/booking')
 
+MAX_EVENTS_PER_POST = 100
+
+MAX_AVAILABILITY_DAYS = 31
+
+# bulk / recurring bookings (api_bulk_book)
+MAX_BULK_ITEMS = 500
+MAX_RECURRENCE_DAYS = 120
+WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+
+# live desk updates (api_stream)
+# Each open stream holds a worker thread on sync/threaded servers, so streams are
+# short (the EventSource reconnects and reloads the map) and capped per process;
+# floor pages over the cap get a 503 and poll instead. See wsgi.py.
+STREAM_MAX_SECONDS = 25   # app.config["STREAM_MAX_SECONDS"]
+STREAM_MAX_OPEN = 4       # app.config["STREAM_MAX_OPEN"]
+STREAM_HEARTBEAT = 10
+STREAM_RETRY_MS = 3000
+
+
+def _conflict(error):
+    """
+    "desk" or "user" when an IntegrityError comes from one of the unique booking
+    indexes (PostgreSQL names the index, SQLite lists its columns), else None.
+    """
+    msg = str(error.orig)
+    if "uq_booking_user_slot" in msg or "UNIQUE constraint failed: booking.user_id" in msg:
+        return "user"
+    if "uq_booking_desk_slot" in msg or "UNIQUE constraint failed: booking.desk_number" in msg:
+        return "desk"
+    return None
+
+
+def _insert_booking(b):
+    """
+    Insert a booking in one round trip and let the unique indexes on Booking
+    reject double-bookings. Returns None on success, otherwise "desk" or "user"
+    depending on which constraint was hit. Any other IntegrityError is re-raised.
+    """
+    db.session.add(b)
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        conflict = _conflict(e)
+        if conflict is None:
+            raise
+        return conflict
+    return None
+
+
+def _slot_over(date, slot):
+    """True when the slot has already ended (bookings are only taken for current or future slots)."""
+    return slot_window(date, slot)[1] <= datetime.utcnow()
+
+
+def _reject_desk(floor, desk):
+    """
+    Validate a desk against the floor plan index (utils/floors.py).
+    Returns an error response for honeypot, non-bookable or unknown desks, else None.
+    """
+    d = floors.desk(floor, desk)
+    honeypot = d.honeypot if d else str(desk).upper().startswith("HP")
+    if honeypot:
+        log_event(
+            "honeypot_triggered",
+            user_id=current_user.id,
+            device_id=session.get("device_id"),
+            details=f"User attempted to book hidden desk {desk}"
+        )
+        return jsonify({"error": "This desk cannot be booked."}), 403
+
+    if desk and floors.get(floor) is not None:
+        if d is None:
+            return jsonify({"error": f"Unknown desk {desk} on floor {floor}"}), 400
+        if not d.bookable:
+            return jsonify({"error": "This desk cannot be booked."}), 403
+    return None
+
+
+def _slot_codes():
+    return [code for (code,) in db.session.query(Slot.code).order_by(Slot.position).all()]
+
+
+def _expand_recurrence(rule):
+    """
+    Turn {"desk", "floor", "slots" | "slot", "start", "end", "weekdays": ["tue", "thu"]}
+    into a list of booking items, one per matching day and slot.
+    """
+    start = parse_day(rule.get("start"))
+    end = parse_day(rule.get("end"))
+    if start is None or end is None:
+        raise ValueError("start/end must be YYYY-MM-DD")
+    if end < start or (end - start).days >= MAX_RECURRENCE_DAYS:
+        raise ValueError(f"recurrence must span 1-{MAX_RECURRENCE_DAYS} days")
+
+    weekdays = rule.get("weekdays") or list(WEEKDAYS)
+    if not isinstance(weekdays, list):
+        raise ValueError('weekdays must be a list, e.g. ["tue", "thu"]')
+    slots = rule.get("slots") or [rule.get("slot")]
+    if not isinstance(slots, list):
+        raise ValueError("slots must be a list")
+    codes = _slot_codes()
+    for slot in slots:
+        if not isinstance(slot, str) or slot not in codes:
+            raise ValueError(f"unknown slot {slot!r}")
+
+    days = set()
+    for w in weekdays:
+        w = str(w).lower()[:3]
+        if w.isdigit():
+            days.add(int(w))
+        elif w in WEEKDAYS:
+            days.add(WEEKDAYS[w])
+        else:
+            raise ValueError(f"unknown weekday {w}")
+
+    items = []
+    for i in range((end - start).days + 1):
+        day = start + timedelta(days=i)
+        if day.weekday() in days:
+            for slot in slots:
+                items.append({"desk": rule.get("desk"), "date": day.isoformat(),
+                              "slot": slot, "floor": rule.get("floor") or 1})
+    return items
+
+
+@lru_cache(maxsize=1)
+def _wrapper_version():
+    # floor_wrapper.html only changes on deploy (i.e. with a process restart)
+    path = os.path.join(current_app.root_path, "templates", "floor_wrapper.html")
+    return int(os.path.getmtime(path)) if os.path.exists(path) else 0
+
+
 # ------------- UI views for Deskhop flow --------------
 @booking_bp.route('/dashboard')
 @login_required
 def dashboard():
-    bookings = Booking.query.filter_by(user_id=current_user.id).order_by(Booking.date.desc(), Booking.timeslot).all()
+    bookings = Booking.query.filter_by(user_id=current_user.id).order_by(Booking.starts_at.desc()).all()
     return render_template('booking.html', bookings=bookings)
 
 
@@ -23,7 +163,8 @@ def book():
         date = request.form.get('date')
         slot = request.form.get('slot')
         return redirect(url_for('booking.floor_page', floor_id=1, date=date, slot=slot))
-    return render_template('booking_select.html')
+    slots = Slot.query.order_by(Slot.position).all()
+    return render_template('booking_select.html', slots=slots)
 
 
 @booking_bp.route('/floor/<int:floor_id>')
@@ -32,43 +173,160 @@ def floor_page(floor_id):
     date = request.args.get('date')
     slot = request.args.get('slot')
 
-    # choose filename (static files must be placed exactly under static/floors/)
-    filename = f"floor{floor_id}.html"
-    static_path = os.path.join(current_app.root_path, 'static', 'floors')
-    file_path = os.path.join(static_path, filename)
-
-    if not os.path.exists(file_path):
-        return f"Floor file not found: {filename}", 404
-        
-
-    # read the static floor HTML (unchanged) and pass as safe HTML into wrapper
-    with open(file_path, 'r', encoding='utf-8') as fh:
-        floor_html = fh.read()
-
-    print("SERVING FLOOR HTML FROM:", file_path)
-    
-
-    return render_template("floor_wrapper.html",
-                           date=date,
-                           slot=slot,
-                           floor=floor_id,
-                           floor_html=floor_html)
+    # floor HTML comes from the in-memory registry (utils/floors.py), not from disk
+    plan = floors.get(floor_id)
+    if plan is None:
+        return f"Floor file not found: floor{floor_id}.html", 404
+
+    # the page only changes with the floor file and these inputs, so let browsers revalidate
+    etag = hashlib.sha1(
+        f"{plan.etag}|{_wrapper_version()}|{date}|{slot}|{current_user.username}".encode("utf-8")
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        resp = make_response(render_template("floor_wrapper.html",
+                                             date=date,
+                                             slot=slot,
+                                             floor=floor_id,
+                                             floor_html=plan.html))
+    resp.set_etag(etag)
+    resp.last_modified = plan.last_modified
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
 
 
 # ------------- Internal API (used by floor.html loader) --------------
 @booking_bp.route('/api/desks')
 @login_required
 def api_desks():
-    date = request.args.get('date')
+    date = parse_day(request.args.get('date'))
     slot = request.args.get('slot')
     floor = request.args.get('floor', type=int) or 1
     if not date or not slot:
         return jsonify({}), 400
 
-    rows = Booking.query.filter_by(date=date, timeslot=slot, floor=floor).all()
+    desks = occupancy.get_floor(date, slot, floor)
+    out = {}
+    for desk, (user_id, booking_id, _name) in desks.items():
+        out[desk] = {"user_id": user_id, "booking_id": booking_id}
+    return jsonify(out), 200
+
+
+@booking_bp.route('/api/stream')
+@login_required
+def api_stream():
+    """
+    Server-sent events: booking created/deleted deltas for one date+slot+floor.
+    Streams for at most STREAM_MAX_SECONDS, then the browser's EventSource reconnects.
+    Returns 503 when STREAM_MAX_OPEN streams are already open in this process.
+    """
+    date = parse_day(request.args.get('date'))
+    slot = request.args.get('slot')
+    floor = request.args.get('floor', type=int) or 1
+    if not date or not slot:
+        return jsonify({"error": "missing date/slot"}), 400
+
+    topic = (date.isoformat(), str(slot), floor)
+    q = pubsub.subscribe(topic, limit=current_app.config.get("STREAM_MAX_OPEN", STREAM_MAX_OPEN))
+    if q is None:
+        return jsonify({"error": "too many live streams, poll instead"}), 503, {"Retry-After": "30"}
+    max_seconds = current_app.config.get("STREAM_MAX_SECONDS", STREAM_MAX_SECONDS)
+
+    def stream():
+        deadline = time.monotonic() + max_seconds
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                data = q.get(timeout=min(STREAM_HEARTBEAT, left))
+                yield f"data: {data}\n\n"
+            except queue.Empty:
+                yield ": keepalive\n\n"
+
+    resp = current_app.response_class(stream(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    # runs even if the client goes away before the generator starts
+    resp.call_on_close(lambda: pubsub.unsubscribe(topic, q))
+    return resp
+
+
+@booking_bp.route('/api/availability')
+@login_required
+def api_availability():
+    """
+    Free/occupied counts per floor for a date range x slot grid, e.g.
+      /booking/api/availability?start=2025-01-06&end=2025-01-10&slots=Slot 1,Slot 2
+    One query over the range; capacity and the set of bookable desks come from the
+    floor plan index, so bookings on honeypot, disabled or unknown desks don't count.
+    Slots that have already ended are reported with "ended": true and nothing free.
+    """
+    start = parse_day(request.args.get('start'))
+    end = parse_day(request.args.get('end')) if request.args.get('end') else start
+    if start is None or end is None:
+        return jsonify({"error": "start/end must be YYYY-MM-DD"}), 400
+    if end < start or (end - start).days >= MAX_AVAILABILITY_DAYS:
+        return jsonify({"error": f"range must be 1-{MAX_AVAILABILITY_DAYS} days"}), 400
+
+    slots = [x.strip() for x in (request.args.get('slots') or "").split(",") if x.strip()] or _slot_codes()
+
+    plans = {}
+    for floor_id in floors.floor_ids():
+        plan = floors.get(floor_id)
+        if plan is not None:
+            plans[floor_id] = plan
+
+    rows = db.session.query(Booking.date, Booking.timeslot, Booking.floor, Booking.desk_number) \
+                     .filter(Booking.date >= start,
+                             Booking.date <= end,
+                             Booking.timeslot.in_(slots),
+                             Booking.status != "Released") \
+                     .distinct().all()
+    booked = {}
+    for d, s, f, desk in rows:
+        plan = plans.get(f)
+        if plan is not None and desk in plan.desks and plan.desks[desk].bookable:
+            booked[(d, s, f)] = booked.get((d, s, f), 0) + 1
+
+    grid = {}
+    for i in range((end - start).days + 1):
+        day = start + timedelta(days=i)
+        grid[day.isoformat()] = {}
+        for slot in slots:
+            ended = _slot_over(day, slot)
+            per_floor = {}
+            for floor_id, plan in plans.items():
+                n = booked.get((day, slot, floor_id), 0)
+                per_floor[floor_id] = {"capacity": plan.capacity, "booked": n, "ended": ended,
+                                       "free": 0 if ended else max(0, plan.capacity - n)}
+            grid[day.isoformat()][slot] = per_floor
+
+    return jsonify({"slots": slots, "days": grid}), 200
+
+
+@booking_bp.route('/api/floor_stats')
+@login_required
+def api_floor_stats():
+    # Capacity per floor/zone comes from the floor plan index; occupancy from memory.
+    date = parse_day(request.args.get('date'))
+    slot = request.args.get('slot')
+
     out = {}
-    for r in rows:
-        out[str(r.desk_number)] = {"user_id": r.user_id, "booking_id": r.id}
+    for floor_id in floors.floor_ids():
+        plan = floors.get(floor_id)
+        if plan is None:
+            continue
+        stats = {"capacity": plan.capacity, "zones": plan.zone_capacity()}
+        if date and slot:
+            booked = sum(1 for desk in occupancy.get_floor(date, slot, floor_id)
+                         if desk in plan.desks and plan.desks[desk].bookable)
+            stats["booked"] = booked
+            stats["free"] = max(0, plan.capacity - booked)
+        out[floor_id] = stats
     return jsonify(out), 200
 
 
@@ -77,33 +335,19 @@ def api_desks():
 def api_book():
     data = request.get_json() or {}
     desk = data.get('desk') or data.get('desk_number') or data.get('deskId')
-    # HONEYPOT DETECTION
-    if str(desk).startswith("HP"):
-        from utils.logging import log_event
-        log_event(
-             "honeypot_triggered",
-            user_id=current_user.id,
-            device_id=session.get("device_id"),
-            details=f"User attempted to book hidden desk {desk}"
-            )
-        return jsonify({"error": "This desk cannot be booked."}), 403
-
-    date = data.get('date')
+    date = parse_day(data.get('date'))
     slot = data.get('slot')
     floor = int(data.get('floor') or 1)
 
+    # HONEYPOT DETECTION + desk validation against the floor plan
+    rejected = _reject_desk(floor, desk)
+    if rejected:
+        return rejected
+
     if not desk or not date or not slot:
         return jsonify({"error": "missing desk/date/slot"}), 400
-
-    # Prevent desk double-book
-    exists = Booking.query.filter_by(desk_number=str(desk), date=date, timeslot=slot, floor=floor).first()
-    if exists:
-        return jsonify({"error": "Desk already booked for this date+slot"}), 409
-
-    # Prevent user multiple bookings same date+slot
-    user_conflict = Booking.query.filter_by(user_id=current_user.id, date=date, timeslot=slot).first()
-    if user_conflict:
-        return jsonify({"error": "You already have a booking for this date and slot"}), 409
+    if _slot_over(date, slot):
+        return jsonify({"error": "That slot has already ended"}), 400
 
     b = Booking(
     user_id=current_user.id,
@@ -114,32 +358,161 @@ def api_book():
     status="Upcoming"
 )
 
-    db.session.add(b)
-    db.session.commit()
+    # Unique indexes prevent desk double-book and user multiple bookings same date+slot
+    conflict = _insert_booking(b)
+    if conflict == "desk":
+        return jsonify({"error": "Desk already booked for this date+slot"}), 409
+    if conflict == "user":
+        return jsonify({"error": "You already have a booking for this date and slot"}), 409
+
+    occupancy.add_booking(b, current_user.username)
     return jsonify({"ok": True, "booking_id": b.id}), 201
 
 
+@booking_bp.route('/api/bookings/bulk', methods=['POST'])
+@login_required
+def api_bulk_book():
+    """
+    Create many bookings in one transaction.
+      {"items": [{"desk", "date", "slot", "floor"}, ...]}  or  {"recurrence": {...}}
+      "atomic": true  -> all-or-nothing (default); false -> book what is free
+    Conflicts are checked with two set-based queries, then everything is inserted
+    and committed once. Returns per-item results.
+    """
+    payload = request.get_json() or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
+    atomic = payload.get("atomic", True) is not False
+
+    try:
+        if payload.get("recurrence"):
+            if not isinstance(payload["recurrence"], dict):
+                raise ValueError("recurrence must be an object")
+            items = _expand_recurrence(payload["recurrence"])
+        else:
+            items = payload.get("items") or []
+            if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+                raise ValueError("items must be a list of objects")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not items:
+        return jsonify({"error": "no items"}), 400
+    if len(items) > MAX_BULK_ITEMS:
+        return jsonify({"error": f"at most {MAX_BULK_ITEMS} bookings per request"}), 400
+
+    codes = set(_slot_codes())
+    failed = []
+    wanted = []
+    honeypots = []
+    for item in items:
+        desk = str(item.get("desk") or item.get("desk_number") or "")
+        date = parse_day(item.get("date"))
+        slot = item.get("slot")
+        try:
+            floor = int(item.get("floor") or 1)
+        except (TypeError, ValueError):
+            floor = None
+        if not desk or not date or not slot or floor is None:
+            failed.append({"item": item, "error": "missing desk/date/slot"})
+            continue
+        if not isinstance(slot, str) or slot not in codes:
+            # slot_window() would treat an unknown code as the whole day
+            failed.append({"item": item, "error": f"Unknown slot {slot!r}"})
+            continue
+        if _slot_over(date, slot):
+            failed.append({"item": item, "error": "That slot has already ended"})
+            continue
+
+        d = floors.desk(floor, desk)
+        if (d.honeypot if d else desk.upper().startswith("HP")):
+            honeypots.append(desk)
+            failed.append({"item": item, "error": "This desk cannot be booked."})
+        elif floors.get(floor) is not None and (d is None or not d.bookable):
+            failed.append({"item": item, "error": f"Desk {desk} is not bookable on floor {floor}"})
+        else:
+            wanted.append((item, desk, date, slot, floor))
+
+    if honeypots:
+        log_event(
+            "honeypot_triggered",
+            user_id=current_user.id,
+            device_id=session.get("device_id"),
+            details=f"User attempted to bulk-book hidden desk(s) {', '.join(sorted(set(honeypots)))}"
+        )
+
+    # Set-based conflict checks: one query for taken desks, one for the user's own slots
+    dates = {w[2] for w in wanted}
+    taken = set()
+    mine = set()
+    if wanted:
+        taken = set(db.session.query(Booking.desk_number, Booking.date, Booking.timeslot, Booking.floor)
+                    .filter(Booking.date.in_(dates),
+                            Booking.desk_number.in_({w[1] for w in wanted}),
+                            Booking.floor.in_({w[4] for w in wanted}),
+                            Booking.status != "Released").all())
+        mine = set(db.session.query(Booking.date, Booking.timeslot)
+                   .filter(Booking.user_id == current_user.id, Booking.date.in_(dates),
+                           Booking.status != "Released").all())
+
+    to_create = []
+    for item, desk, date, slot, floor in wanted:
+        if (desk, date, slot, floor) in taken:
+            failed.append({"item": item, "error": "Desk already booked for this date+slot"})
+        elif (date, slot) in mine:
+            failed.append({"item": item, "error": "You already have a booking for this date and slot"})
+        else:
+            # later items in the same request must not collide with earlier ones
+            taken.add((desk, date, slot, floor))
+            mine.add((date, slot))
+            to_create.append((item, Booking(user_id=current_user.id, desk_number=desk, date=date,
+                                            timeslot=slot, floor=floor, status="Upcoming")))
+
+    if failed and atomic:
+        return jsonify({"ok": False, "created": [], "failed": failed}), 409
+    if not to_create:
+        return jsonify({"ok": False, "created": [], "failed": failed}), 409
+
+    db.session.add_all([b for _, b in to_create])
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        # someone booked one of these desks between the check and the insert
+        db.session.rollback()
+        if _conflict(e) is None:
+            raise
+        return jsonify({"ok": False, "created": [],
+                        "failed": failed + [{"item": item, "error": "Conflicting booking created concurrently; retry"}
+                                            for item, _ in to_create]}), 409
+
+    created = []
+    for item, b in to_create:
+        occupancy.add_booking(b, current_user.username)
+        created.append({"item": item, "booking_id": b.id})
+
+    return jsonify({"ok": not failed, "created": created, "failed": failed}), 201 if not failed else 207
+
+
 # ------------- Compatibility public API routes (for original friend's UI) --------------
 # GET mapping for booked desks used by original UI
 @booking_bp.route("/api/bookings")
 def get_bookings():
-    date = request.args.get("date")
+    date = parse_day(request.args.get("date"))
     slot = request.args.get("slot")
     floor = request.args.get("floor", type=int)
 
-    rows = Booking.query.filter_by(
-        date=date,
-        timeslot=slot,
-        floor=floor
-    ).all()
+    if not date or not slot or floor is None:
+        return jsonify({})
+
+    desks = occupancy.get_floor(date, slot, floor)
 
     result = {}
-    for b in rows:
-        result[b.desk_number] = {
-            "name": b.user.username if hasattr(b.user, "username") else str(b.user_id),
-            "user_id": b.user_id,
-            "slot": b.timeslot,
-            "floor": b.floor
+    for desk, (user_id, _booking_id, name) in desks.items():
+        result[desk] = {
+            "name": name if name else str(user_id),
+            "user_id": user_id,
+            "slot": slot,
+            "floor": floor
         }
     return jsonify(result)
 
@@ -152,23 +525,21 @@ def get_bookings():
 def compat_create_booking():
     payload = request.get_json() or {}
     desk = payload.get('desk') or payload.get('desk_number') or payload.get('deskId')
-    date = payload.get('date')
+    date = parse_day(payload.get('date'))
     slot = payload.get('slot')
     floor = int(payload.get('floor') or 1)
 
+    # honeypot / desk validation first, as in api_book, so probes are always logged
+    rejected = _reject_desk(floor, desk)
+    if rejected:
+        return rejected
+
     if not desk or not date or not slot:
         return jsonify({"error": "missing fields"}), 400
+    if _slot_over(date, slot):
+        return jsonify({"error": "That slot has already ended"}), 400
 
     # If front-end sent "name" and user is not logged in — we require login => but we enforce current_user
-    # Prevent double-booking
-    exists = Booking.query.filter_by(desk_number=str(desk), date=date, timeslot=slot, floor=floor).first()
-    if exists:
-        return jsonify({"error": "Desk already booked"}), 409
-
-    conflict = Booking.query.filter_by(user_id=current_user.id, date=date, timeslot=slot).first()
-    if conflict:
-        return jsonify({"error": "You already booked a desk for that slot"}), 409
-
     b = Booking(
     user_id=current_user.id,
     desk_number=str(desk),
@@ -178,19 +549,27 @@ def compat_create_booking():
     status="Upcoming"
 )
 
-    db.session.add(b)
-    db.session.commit()
+    # Prevent double-booking (enforced by the unique indexes on Booking)
+    conflict = _insert_booking(b)
+    if conflict == "desk":
+        return jsonify({"error": "Desk already booked"}), 409
+    if conflict == "user":
+        return jsonify({"error": "You already booked a desk for that slot"}), 409
+
+    occupancy.add_booking(b, current_user.username)
     return jsonify({"ok": True, "booking_id": b.id}), 201
 
 
 @booking_bp.route('/api/bookings/<desk_id>', methods=['DELETE'])
 @login_required
 def compat_delete_booking(desk_id):
-    date = request.args.get('date')
+    date = parse_day(request.args.get('date'))
     slot = request.args.get('slot')
     floor = request.args.get('floor', type=int) or None
+    if request.args.get('date') and date is None:
+        return jsonify({"error": "Booking not found"}), 404
 
-    q = Booking.query.filter_by(desk_number=str(desk_id))
+    q = Booking.query.filter(Booking.desk_number == str(desk_id), Booking.status != "Released")
     if date:
         q = q.filter_by(date=date)
     if slot:
@@ -208,6 +587,7 @@ def compat_delete_booking(desk_id):
 
     db.session.delete(b)
     db.session.commit()
+    occupancy.remove_booking(b)
     return jsonify({"ok": True}), 200
 
 # ------------------------------------------------------------
@@ -220,7 +600,7 @@ def mybookings():
     rows = Booking.query.filter(
         Booking.user_id == current_user.id,
         Booking.status.in_(["Upcoming", "Active"])
-    ).order_by(Booking.date.asc(), Booking.timeslot.asc()).all()
+    ).order_by(Booking.starts_at.asc()).all()
 
     # optional: you can still show completed bookings on a separate page if needed
     return render_template('mybookings.html', bookings=rows)
@@ -273,9 +653,17 @@ def start_session(booking_id):
     b.session_start = datetime.utcnow()
     db.session.commit()
 
-    
+    # Resume PIN for this session (valid until the slot ends, bound to this device)
+    ends = b.ends_at.replace(tzinfo=timezone.utc).timestamp() if b.ends_at else None
+    pin, ticket = resume.issue(current_app.config["SECRET_KEY"], current_user.id, b.id,
+                               session.get("device_id"), expires=ends)
+    session["resume_ticket"] = ticket
 
-    return redirect(url_for('booking.fullscreen_workspace', booking_id=booking_id))
+    # Render the workspace here rather than redirecting: the plain PIN then only
+    # travels in this response, never in the (signed, not encrypted) session cookie.
+    resp = make_response(render_template("workspace.html", booking_id=booking_id, resume_pin=pin))
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 
 # ------------------------------------------------------------
@@ -284,6 +672,7 @@ def start_session(booking_id):
 @booking_bp.route('/fullscreen_workspace/<int:booking_id>')
 @login_required
 def fullscreen_workspace(booking_id):
+    # the resume PIN is only shown by start_session
     return render_template("workspace.html", booking_id=booking_id)
 
 
@@ -308,12 +697,46 @@ def pause_session(booking_id):
 @booking_bp.route('/resume_auth/<int:booking_id>', methods=["GET", "POST"])
 @login_required
 def resume_auth(booking_id):
+    ticket = session.get("resume_ticket")
+    has_pin = bool(ticket) and ticket.get("booking_id") == booking_id
+
+    if request.method == "POST" and request.form.get("pin") is not None:
+        # cheap path: HMAC check of the PIN issued at start_session
+        result = resume.verify(current_app.config["SECRET_KEY"], ticket, current_user.id,
+                               booking_id, session.get("device_id"), request.form.get("pin"))
+        if result == "ok":
+            log_event(
+                "session_resume",
+                user_id=current_user.id,
+                device_id=session.get("device_id"),
+                details="resume_pin_success"
+            )
+            return redirect(url_for("booking.fullscreen_workspace", booking_id=booking_id))
+
+        log_event(
+            "resume_auth_failed",
+            user_id=current_user.id,
+            device_id=session.get("device_id"),
+            details=f"pin_{result}"
+        )
+        if result == "invalid":
+            flash("Incorrect PIN.", "danger")
+        elif result == "locked":
+            flash("Too many wrong PINs. Please enter your password.", "danger")
+        else:
+            flash("PIN expired. Please enter your password.", "warning")
+        return redirect(url_for("booking.resume_auth", booking_id=booking_id))
+
     if request.method == "POST":
         password = request.form.get("password")
 
-        from werkzeug.security import check_password_hash
+        try:
+            ok = passwords.verify_and_update(current_user, password)
+        except passwords.HasherBusy:
+            flash("Server busy, please try again.", "warning")
+            return redirect(url_for("booking.resume_auth", booking_id=booking_id))
 
-        if not check_password_hash(current_user.password_hash, password):
+        if not ok:
             log_event(
                 "resume_auth_failed",
                 user_id=current_user.id,
@@ -322,6 +745,10 @@ def resume_auth(booking_id):
             )
             flash("Incorrect password.", "danger")
             return redirect(url_for("booking.resume_auth", booking_id=booking_id))
+        if db.session.is_modified(current_user):
+            db.session.commit()
+            identity.invalidate_user(current_user.id)
+        resume.reset(current_user.id, booking_id)
 
         # SUCCESSFUL RESUME
         log_event(
@@ -333,20 +760,52 @@ def resume_auth(booking_id):
 
         return redirect(url_for("booking.fullscreen_workspace", booking_id=booking_id))
 
-    return render_template("resume_auth.html", booking_id=booking_id)
+    return render_template("resume_auth.html", booking_id=booking_id, has_pin=has_pin)
 
 @booking_bp.route('/api/log_event', methods=['POST'])
 @login_required
 def api_log_event():
-    data = request.get_json() or {}
-    from utils.logging import log_event
-    log_event(
-        data.get("event"),
-        user_id=current_user.id,
-        device_id=session.get("device_id"),
-        details=data.get("details")
-    )
-    return {"ok": True}, 200
+    # Accepts one event {"event", "details"} or a batch: a JSON array, or {"events": [...]}.
+    # Each item may carry "count" when the client already coalesced repeats.
+    # sendBeacon posts as text/plain, so parse the body regardless of content type.
+    data = request.get_json(force=True, silent=True) or {}
+    if isinstance(data, dict):
+        events = data.get("events") if "events" in data else [data]
+    else:
+        events = data
+    if not isinstance(events, list):
+        return {"error": "bad payload"}, 400
+
+    device_id = session.get("device_id")
+    written = 0
+    held = 0
+
+    for item in events[:MAX_EVENTS_PER_POST]:
+        if not isinstance(item, dict) or not item.get("event"):
+            continue
+        event = str(item.get("event"))[:80]
+        details = str(item["details"])[:500] if item.get("details") is not None else None
+        try:
+            count = max(1, int(item.get("count") or 1))
+        except (TypeError, ValueError):
+            count = 1
+
+        # per-user, per-event token bucket: repeats fold into the next row written
+        meta = {"device_id": device_id, "details": details, "ip": request.remote_addr}
+        n = coalesce.admit((current_user.id, event), count, meta=meta)
+        if n:
+            log_event(event, user_id=current_user.id, occurrences=n, **meta)
+            written += 1
+        else:
+            held += count
+
+    # held-back repeats are released by the log writer thread (utils/logging.py);
+    # with ACTIVITY_LOG_SYNC there is no writer, so release them here
+    if current_app.config.get("ACTIVITY_LOG_SYNC"):
+        for (user_id, event), n, meta in coalesce.sweep():
+            log_event(event, user_id=user_id, occurrences=n, **meta)
+
+    return {"ok": True, "written": written, "coalesced": held}, 200
 
 # ------------------------------------------------------------
 # END SESSION
@@ -371,6 +830,7 @@ def end_session(booking_id):
     # remove session variables
     session.pop("active_session", None)
     session.pop("session_start", None)
+    session.pop("resume_ticket", None)
 
     flash("Session completed.", "success")
     return redirect(url_for("booking.dashboard"))
@@ -1,8 +1,12 @@
 # byod.py
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
 from models import db, Device
 from utils.logging import log_event
+from utils import similarity
+from utils.risk import client_hints, risk_score_from
+from utils.pagination import keyset_page, page_limit
+from compliance import device_json
 import hashlib
 import re
 from datetime import datetime
@@ -57,13 +61,27 @@ def register_device():
     payload = request.get_json() or {}
     ip = request.remote_addr
 
-    # compute fingerprint and risk
+    # compute fingerprint, similarity signature and risk
     fp = calc_fingerprint(payload)
-    score = risk_score_from(payload)
+    sig = similarity.signature(similarity.features_from_payload(payload))
+    score = risk_score_from(payload, ip, current_app.config)
+    hints = client_hints(payload)
 
     try:
         # If there's an existing device with same fingerprint, update it
         existing = Device.query.filter_by(user_id=current_user.id, fingerprint=fp).first()
+
+        # Otherwise the user's nearest device (browser upgrade, timezone change, double-post ...)
+        match_score = None
+        lookalike = None
+        if not existing:
+            existing, match_score = similarity.find_device(current_user.id, sig, current_app.config)
+            if existing is not None and existing.status == "Approved":
+                # approval only carries over on an exact fingerprint: a look-alike of an
+                # approved device goes to the admin as a new Pending device
+                lookalike = (existing.id, match_score)
+                existing, match_score = None, None
+
         if existing:
             # preserve Approved if already approved
             if existing.status == "Approved":
@@ -76,42 +94,26 @@ def register_device():
             existing.cpu_threads = payload.get("cpuThreads")
             existing.screen = payload.get("screen")
             existing.timezone = payload.get("timezone")
+            existing.fingerprint = fp
+            existing.fp_signature = similarity.encode(sig)
             existing.ip_address = ip
             existing.risk_score = score
+            for k, v in hints.items():
+                setattr(existing, k, v)
             existing.status = "Pending"
             existing.compliant = False
             existing.updated_at = datetime.utcnow()
 
             db.session.commit()
-            log_event("device_register_update", user_id=current_user.id, device_id=existing.id)
-            return jsonify({"status": "updated", "device_id": existing.id}), 200
-
-        # If a very recent device was created by this user (same IP) within the last few seconds,
-        # treat the new request as an "update" to avoid duplicates caused by double-posts.
-        recent = Device.query.filter_by(user_id=current_user.id).order_by(Device.created_at.desc()).first()
-        if recent:
-            try:
-                age = (datetime.utcnow() - recent.created_at).total_seconds() if recent.created_at else 9999
-            except Exception:
-                age = 9999
-            if recent.ip_address == ip and age < 5:
-                # update the recent record instead of creating a new one
-                recent.name = payload.get("name") or recent.name
-                recent.os_version = payload.get("osVersion") or recent.os_version
-                recent.user_agent = payload.get("userAgent")
-                recent.platform = payload.get("platform")
-                recent.cpu_threads = payload.get("cpuThreads")
-                recent.screen = payload.get("screen")
-                recent.timezone = payload.get("timezone")
-                recent.fingerprint = fp or recent.fingerprint
-                recent.risk_score = score
-                recent.status = "Pending"
-                recent.compliant = False
-                recent.ip_address = ip
-                recent.updated_at = datetime.utcnow()
-                db.session.commit()
-                log_event("device_register_dedup", user_id=current_user.id, device_id=recent.id)
-                return jsonify({"status": "dedup_updated", "device_id": recent.id}), 200
+            similarity.add(existing.id, current_user.id, sig)
+
+            if not match_score:
+                log_event("device_register_update", user_id=current_user.id, device_id=existing.id)
+                return jsonify({"status": "updated", "device_id": existing.id}), 200
+
+            log_event("device_register_matched", user_id=current_user.id, device_id=existing.id,
+                      details=f"similarity={match_score:.2f}")
+            return jsonify({"status": "matched", "device_id": existing.id}), 200
 
         # create new device record (Pending) — allow multiple devices per user
         d = Device(
@@ -123,17 +125,22 @@ def register_device():
             screen=payload.get("screen"),
             timezone=payload.get("timezone"),
             fingerprint=fp,
+            fp_signature=similarity.encode(sig),
             ip_address=ip,
             risk_score=score,
             status="Pending",
             compliant=False,
             user_id=current_user.id,
-            created_at=datetime.utcnow()
+            created_at=datetime.utcnow(),
+            **hints
         )
 
         db.session.add(d)
         db.session.commit()
-        log_event("device_registered", user_id=current_user.id, device_id=d.id)
+        similarity.add(d.id, current_user.id, sig)
+        log_event("device_registered", user_id=current_user.id, device_id=d.id,
+                  details=(f"looks like approved device {lookalike[0]} (similarity={lookalike[1]:.2f})"
+                           if lookalike else None))
         return jsonify({"status": "created", "device_id": d.id}), 201
 
     except Exception as e:
@@ -148,8 +155,16 @@ def register_device():
 @byod_bp.route("/register_page")
 @login_required
 def register_page():
-    devices = Device.query.filter_by(user_id=current_user.id).order_by(Device.created_at.desc()).all()
-    return render_template("device_register.html", devices=devices)
+    devices, next_cursor = keyset_page(
+        Device.query.filter_by(user_id=current_user.id),
+        Device.created_at, Device.id,
+        cursor=request.args.get("cursor"),
+        limit=page_limit(request.args.get("limit"))
+    )
+
+    if request.args.get("format") == "json":
+        return jsonify({"devices": [device_json(d) for d in devices], "next_cursor": next_cursor})
+    return render_template("device_register.html", devices=devices, next_cursor=next_cursor)
 
 
 # -------------------------
@@ -198,5 +213,6 @@ def delete_device(device_id):
         return "Not allowed", 403
     db.session.delete(d)
     db.session.commit()
+    similarity.remove(device_id)
     flash("Device removed.", "success")
     return redirect(url_for('byod.register_page'))
@@ -1,9 +1,23 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
 from models import Device
+from utils.pagination import keyset_page, page_limit
 
 compliance_bp = Blueprint('compliance', __name__, url_prefix='/compliance')
 
+
+def device_json(d):
+    return {
+        "id": d.id,
+        "user_id": d.user_id,
+        "name": d.name,
+        "platform": d.platform or d.os_version,
+        "status": d.status,
+        "risk_score": d.risk_score,
+        "created_at": d.created_at.isoformat() if d.created_at else None
+    }
+
+
 # -----------------------------------
 # DEVICE LIST FOR ADMINS (READ ONLY)
 # -----------------------------------
@@ -13,8 +27,15 @@ def list_devices():
     if not current_user.is_admin:
         return "Access denied", 403
 
-    devices = Device.query.order_by(Device.id.desc()).all()
-    return render_template('devices.html', devices=devices)
+    devices, next_cursor = keyset_page(
+        Device.query, Device.created_at, Device.id,
+        cursor=request.args.get("cursor"),
+        limit=page_limit(request.args.get("limit"))
+    )
+
+    if request.args.get("format") == "json":
+        return jsonify({"devices": [device_json(d) for d in devices], "next_cursor": next_cursor})
+    return render_template('devices.html', devices=devices, next_cursor=next_cursor)
 
 # -----------------------------------
 # USER VIEW: SEE THEIR OWN DEVICES
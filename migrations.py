@@ -0,0 +1,305 @@
+# migrations.py
+"""
+Minimal schema migrations for Deskhop.
+
+db.create_all() only creates missing tables; it never touches tables that
+already exist. Each entry in MIGRATIONS is applied once, in order, and
+recorded in the schema_migrations table.
+
+    python migrations.py           # apply pending migrations
+    python migrations.py --check   # fail if a hot query does a table scan
+"""
+import re
+import sys
+from datetime import datetime, date
+from sqlalchemy import text, inspect, bindparam
+from models import db, User, Device, Booking, ActivityLog, ActivityLogArchive, Alert, OutboundMail, Slot, DEFAULT_SLOTS, parse_day, slot_window, clear_slot_cache
+from utils import counters, similarity
+
+
+def add_columns(table, columns):
+    """Return a migration step that adds any of {name: ddl_type} missing from table."""
+    def step():
+        existing = {c["name"] for c in inspect(db.engine).get_columns(table)}
+        for name, ddl in columns.items():
+            if name not in existing:
+                db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+    return step
+
+
+def check_duplicate_bookings(where="1=1", limit=20):
+    """
+    Return a migration step that aborts, listing the offenders, if bookings
+    already break the unique desk/user slot indexes about to be created.
+    Resolve them by hand (cancel or move one of each pair), then re-run.
+    """
+    groups = [
+        ("desk", "desk_number, date, timeslot, floor"),
+        ("user", "user_id, date, timeslot"),
+    ]
+
+    def step():
+        problems = []
+        for kind, cols in groups:
+            rows = db.session.execute(text(
+                f"SELECT {cols}, COUNT(*), MIN(id), MAX(id) FROM booking WHERE {where} "
+                f"GROUP BY {cols} HAVING COUNT(*) > 1 LIMIT {limit}"
+            )).fetchall()
+            for row in rows:
+                *key, n, first, last = row
+                problems.append(f"  {kind} {tuple(key)}: {n} bookings (ids {first}..{last})")
+        if problems:
+            db.session.rollback()
+            raise RuntimeError("Duplicate bookings block the unique booking indexes:\n"
+                               + "\n".join(problems)
+                               + "\nRemove or move the extra bookings, then run the migration again.")
+    return step
+
+
+def seed_slots():
+    if not Slot.query.first():
+        for i, (code, label, start, end) in enumerate(DEFAULT_SLOTS):
+            db.session.add(Slot(code=code, label=label, start_time=start, end_time=end, position=i))
+        db.session.flush()
+    clear_slot_cache()
+
+
+def convert_booking_dates(batch=500):
+    """
+    Rewrite legacy Booking.date strings as ISO dates and fill starts_at/ends_at
+    from the slot table. Reads raw values so non-ISO strings don't break the Date type.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("ALTER TABLE booking ALTER COLUMN date TYPE DATE USING date::date"))
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            text("SELECT id, CAST(date AS VARCHAR(20)), timeslot FROM booking WHERE id > :last ORDER BY id LIMIT :n"),
+            {"last": last_id, "n": batch}
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, raw, timeslot in rows:
+            day = parse_day(raw)
+            if day is None:
+                print(f"⚠️ Booking {row_id}: unparseable date {raw!r} left as is")
+                continue
+            starts_at, ends_at = slot_window(day, timeslot)
+            db.session.execute(
+                text("UPDATE booking SET date = :d, starts_at = :s, ends_at = :e WHERE id = :id")
+                .bindparams(bindparam("d", type_=db.Date), bindparam("s", type_=db.DateTime),
+                            bindparam("e", type_=db.DateTime)),
+                {"d": day, "s": starts_at, "e": ends_at, "id": row_id}
+            )
+        last_id = rows[-1][0]
+
+
+# (version, name, [sql or callable, ...]) — never edit an applied entry, append a new one
+MIGRATIONS = [
+    (1, "device_client_hint_columns", [
+        add_columns("device", {
+            "battery": "VARCHAR(20)",
+            "charging": "BOOLEAN",
+            "touch_support": "BOOLEAN",
+            "device_memory": "VARCHAR(20)",
+            "connection_type": "VARCHAR(50)",
+        }),
+    ]),
+    (2, "booking_unique_slots", [
+        check_duplicate_bookings(),
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_booking_desk_slot ON booking (desk_number, date, timeslot, floor)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_booking_user_slot ON booking (user_id, date, timeslot)",
+    ]),
+    (3, "hot_query_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_booking_slot_floor ON booking (date, timeslot, floor)",
+        'CREATE INDEX IF NOT EXISTS ix_user_is_approved ON "user" (is_approved)',
+        "CREATE INDEX IF NOT EXISTS ix_device_user_fingerprint ON device (user_id, fingerprint)",
+        "CREATE INDEX IF NOT EXISTS ix_device_status_user ON device (status, user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_device_risk_score ON device (risk_score)",
+        "CREATE INDEX IF NOT EXISTS ix_activity_log_event_time ON activity_log (event, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_activity_log_device_time ON activity_log (device_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_activity_log_user ON activity_log (user_id)",
+    ]),
+    (4, "activity_log_occurrences", [
+        add_columns("activity_log", {"occurrences": "INTEGER DEFAULT 1"}),
+    ]),
+    (5, "event_counter_backfill", [
+        counters.rebuild,
+    ]),
+    (6, "keyset_pagination_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_device_user_created ON device (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_device_created ON device (created_at)",
+    ]),
+    (7, "booking_native_dates", [
+        seed_slots,
+        add_columns("booking", {"starts_at": "TIMESTAMP", "ends_at": "TIMESTAMP"}),
+        convert_booking_dates,
+        "CREATE INDEX IF NOT EXISTS ix_booking_user_starts ON booking (user_id, starts_at)",
+        "CREATE INDEX IF NOT EXISTS ix_booking_status_ends ON booking (status, ends_at)",
+    ]),
+    (8, "booking_release_partial_unique", [
+        # released no-shows stop holding their desk/user slot
+        check_duplicate_bookings("status != 'Released'"),
+        "DROP INDEX IF EXISTS uq_booking_desk_slot",
+        "DROP INDEX IF EXISTS uq_booking_user_slot",
+        "CREATE UNIQUE INDEX uq_booking_desk_slot ON booking (desk_number, date, timeslot, floor) WHERE status != 'Released'",
+        "CREATE UNIQUE INDEX uq_booking_user_slot ON booking (user_id, date, timeslot) WHERE status != 'Released'",
+    ]),
+    (9, "archive_tables", [
+        # booking_archive / activity_log_archive / archive_run come from create_all()
+        "CREATE INDEX IF NOT EXISTS ix_activity_log_created ON activity_log (created_at)",
+    ]),
+    (10, "device_fp_signature", [
+        add_columns("device", {"fp_signature": "VARCHAR(512)"}),
+        similarity.backfill,
+    ]),
+]
+
+
+def _ensure_version_table():
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY,"
+        " name VARCHAR(100) NOT NULL,"
+        " applied_at DATETIME NOT NULL)"
+    ))
+    db.session.commit()
+
+
+def applied_versions():
+    _ensure_version_table()
+    rows = db.session.execute(text("SELECT version FROM schema_migrations")).fetchall()
+    return {r[0] for r in rows}
+
+
+def upgrade():
+    """
+    Create missing tables, then apply every pending migration.
+    Must run inside an app context. Returns the list of applied versions.
+    """
+    db.create_all()
+    done = applied_versions()
+    applied = []
+
+    for version, name, statements in MIGRATIONS:
+        if version in done:
+            continue
+        for step in statements:
+            if callable(step):
+                step()
+            else:
+                db.session.execute(text(step))
+        db.session.execute(
+            text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+            {"v": version, "n": name, "t": datetime.utcnow()}
+        )
+        db.session.commit()
+        applied.append(version)
+        print(f"✅ Applied migration {version}: {name}")
+
+    return applied
+
+
+# ---------------------------------------------------
+# QUERY PLAN CHECK
+# ---------------------------------------------------
+def hot_queries():
+    """
+    The filtered queries issued by booking.py, admin.py, byod.py and auth.py.
+    Keep in sync with the routes when a query changes.
+    """
+    return {
+        "booking.dashboard": Booking.query.filter_by(user_id=1).order_by(Booking.starts_at.desc()),
+        "booking.floor_occupancy": Booking.query.filter_by(date=date(2025, 1, 1), timeslot="Slot 1", floor=1)
+                                                .filter(Booking.status != "Released"),
+        "booking.compat_delete": Booking.query.filter_by(desk_number="T1", date=date(2025, 1, 1), timeslot="Slot 1", floor=1)
+                                              .filter(Booking.status != "Released"),
+        "booking.availability": db.session.query(Booking.date, Booking.timeslot, Booking.floor, Booking.desk_number)
+                                          .filter(Booking.date >= date(2025, 1, 1), Booking.date <= date(2025, 1, 7),
+                                                  Booking.timeslot.in_(["Slot 1", "Slot 2"]),
+                                                  Booking.status != "Released")
+                                          .distinct(),
+        "lifecycle.no_shows": Booking.query.filter(Booking.status == "Upcoming",
+                                                   Booking.starts_at <= datetime(2025, 1, 1),
+                                                   db.or_(Booking.created_at.is_(None),
+                                                          Booking.created_at <= datetime(2025, 1, 1))).limit(500),
+        "lifecycle.abandoned": Booking.query.filter(Booking.status == "Active",
+                                                    Booking.ends_at <= datetime(2025, 1, 1)).limit(500),
+        "booking.mybookings": Booking.query.filter(
+            Booking.user_id == 1, Booking.status.in_(["Upcoming", "Active"])
+        ).order_by(Booking.starts_at.asc()),
+        "admin.pending_users": User.query.filter_by(is_approved=False),
+        "admin.pending_devices": Device.query.filter(Device.status.in_(["Pending", "Rejected"])),
+        "admin.approved_devices": Device.query.filter_by(status="Approved").order_by(Device.user_id, Device.id),
+        "admin.event_count": ActivityLog.query.filter_by(event="honeypot_triggered"),
+        "admin.risky_devices": Device.query.order_by(Device.risk_score.desc()).limit(5),
+        "admin.nuke_logs": ActivityLog.query.filter_by(user_id=1),
+        "admin.nuke_bookings": Booking.query.filter_by(user_id=1),
+        "admin.device_logs": ActivityLog.query.filter_by(device_id=1).order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc()),
+        "admin.device_alerts": Alert.query.filter(
+            Alert.device_id == 1,
+            Alert.created_at >= datetime(2025, 1, 1)
+        ).order_by(Alert.created_at.desc()),
+        "byod.device_by_fingerprint": Device.query.filter_by(user_id=1, fingerprint="x"),
+        "similarity.user_signatures": db.session.query(Device.id, Device.fp_signature).filter(Device.user_id == 1),
+        "byod.user_devices": Device.query.filter_by(user_id=1).order_by(Device.created_at.desc(), Device.id.desc()),
+        "admin.device_logs_page": ActivityLog.query.filter(
+            ActivityLog.device_id == 1,
+            ActivityLog.created_at <= datetime(2025, 1, 1)
+        ).order_by(ActivityLog.created_at.desc(), ActivityLog.id.desc()).limit(51),
+        "archive.old_bookings": Booking.query.filter(Booking.status.in_(["Completed", "Released"]),
+                                                     Booking.ends_at < datetime(2025, 1, 1)).limit(1000),
+        "archive.old_logs": ActivityLog.query.filter(ActivityLog.created_at < datetime(2025, 1, 1)).limit(1000),
+        "admin.device_logs_archive": ActivityLogArchive.query.filter(
+            ActivityLogArchive.device_id == 1,
+            ActivityLogArchive.created_at <= datetime(2025, 1, 1)
+        ).order_by(ActivityLogArchive.created_at.desc(), ActivityLogArchive.id.desc()).limit(51),
+        "emailer.due": OutboundMail.query.filter(OutboundMail.status == "Pending",
+                                                 OutboundMail.next_attempt_at <= datetime(2025, 1, 1))
+                                         .order_by(OutboundMail.next_attempt_at).limit(50),
+        "auth.user_by_username": User.query.filter_by(username="admin"),
+        "auth.user_by_email": User.query.filter_by(email="admin@deskhop.local"),
+    }
+
+
+# "SCAN booking" is a full table scan; "SCAN device USING INDEX ..." is an ordered index walk.
+_TABLE_SCAN = re.compile(r"^SCAN (TABLE )?(\w+)$")
+
+
+def check_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN (SQLite) on every hot query.
+    Returns {query_name: [plan lines]} for the queries that scan a whole table.
+    """
+    dialect = db.engine.dialect
+    failures = {}
+
+    for name, query in hot_queries().items():
+        sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+        plan = [row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql))]
+        if any(_TABLE_SCAN.match(line) for line in plan):
+            failures[name] = plan
+
+    return failures
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            upgrade()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+        if "--check" in sys.argv:
+            failures = check_query_plans()
+            for name, plan in failures.items():
+                print(f"❌ {name}: " + " | ".join(plan))
+            if failures:
+                sys.exit(1)
+            print("✅ All hot queries use an index.")
@@ -1,8 +1,9 @@
 # models.py
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, date as date_type, time, timedelta
+from sqlalchemy import event, select, text
+import pytz
 
 db = SQLAlchemy()
 
@@ -16,13 +17,19 @@ class User(db.Model, UserMixin):
     is_approved = db.Column(db.Boolean, default=False)
     is_admin = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_user_is_approved', 'is_approved'),
+    )
+
     devices = db.relationship('Device', back_populates='user', cascade="all, delete-orphan")
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from utils.passwords import hash_password
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from utils.passwords import verify_password
+        return verify_password(self.password_hash, password)
 
 
 class Device(db.Model):
@@ -37,6 +44,7 @@ class Device(db.Model):
     user = db.relationship('User', back_populates='devices')
 
     fingerprint = db.Column(db.String(128), unique=False, nullable=True)
+    fp_signature = db.Column(db.String(512), nullable=True)   # MinHash, see utils/similarity.py
     platform = db.Column(db.String(80), nullable=True)
     cpu_threads = db.Column(db.String(20), nullable=True)
     screen = db.Column(db.String(40), nullable=True)
@@ -51,6 +59,85 @@ class Device(db.Model):
     device_memory = db.Column(db.String(20))
     connection_type = db.Column(db.String(50))
 
+    __table_args__ = (
+        db.Index('ix_device_user_fingerprint', 'user_id', 'fingerprint'),
+        db.Index('ix_device_status_user', 'status', 'user_id'),
+        db.Index('ix_device_risk_score', 'risk_score'),
+        db.Index('ix_device_user_created', 'user_id', 'created_at'),
+        db.Index('ix_device_created', 'created_at'),
+    )
+
+
+
+# Office-local slot times; Booking.starts_at / ends_at are stored in naive UTC like every other timestamp.
+OFFICE_TZ = "Asia/Kolkata"
+
+DEFAULT_SLOTS = [
+    # code (value stored in Booking.timeslot), label, start, end
+    ("Slot 1", "Morning", time(9, 0), time(13, 0)),
+    ("Slot 2", "Afternoon", time(13, 0), time(17, 0)),
+    ("Slot 3", "Evening", time(17, 0), time(21, 0)),
+]
+
+# Legacy Booking.date strings accepted by parse_day (ISO first)
+DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d"]
+
+
+def parse_day(value):
+    """Parse a legacy date string (or date) into a date; None if it can't be parsed."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date_type):
+        return value
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class Slot(db.Model):
+    code = db.Column(db.String(30), primary_key=True)
+    label = db.Column(db.String(50), nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+
+_slot_cache = {}
+
+
+def slot_times(connection=None):
+    """{code: (start_time, end_time)} from the Slot table, falling back to DEFAULT_SLOTS."""
+    if not _slot_cache:
+        rows = []
+        if connection is not None:
+            rows = connection.execute(select(Slot.code, Slot.start_time, Slot.end_time)).fetchall()
+        else:
+            rows = db.session.query(Slot.code, Slot.start_time, Slot.end_time).all()
+        _slot_cache.update({code: (start, end) for code, start, end in rows}
+                           or {code: (start, end) for code, _, start, end in DEFAULT_SLOTS})
+    return _slot_cache
+
+
+def clear_slot_cache():
+    _slot_cache.clear()
+
+
+def slot_window(day, code, connection=None):
+    """(starts_at, ends_at) in naive UTC for a slot on a day; the whole day if the slot is unknown."""
+    tz = pytz.timezone(OFFICE_TZ)
+    start, end = slot_times(connection).get(code, (time(0, 0), None))
+    local_start = tz.localize(datetime.combine(day, start))
+    local_end = tz.localize(datetime.combine(day, end)) if end else local_start + timedelta(days=1)
+    return (local_start.astimezone(pytz.utc).replace(tzinfo=None),
+            local_end.astimezone(pytz.utc).replace(tzinfo=None))
+
+
+# Bookings in any other status hold their desk; see utils/lifecycle.py
+HOLDS_DESK = "status != 'Released'"
 
 
 class Booking(db.Model):
@@ -59,19 +146,43 @@ class Booking(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     desk_number = db.Column(db.String(80), nullable=False)
 
-    date = db.Column(db.String(20), nullable=False)
-    timeslot = db.Column(db.String(30), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    timeslot = db.Column(db.String(30), nullable=False)      # Slot.code
 
     floor = db.Column(db.Integer, nullable=False, default=1)
 
-    status = db.Column(db.String(20), default="Upcoming")   # <-- UPDATED
+    status = db.Column(db.String(20), default="Upcoming")   # Upcoming / Active / Completed / Released
     session_start = db.Column(db.DateTime, nullable=True)  # <-- NEW
     session_end = db.Column(db.DateTime, nullable=True)    # <-- NEW
 
+    # slot start/end in UTC, derived from date + timeslot on insert/update
+    starts_at = db.Column(db.DateTime, nullable=True)
+    ends_at = db.Column(db.DateTime, nullable=True)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='bookings', lazy=True)
 
+    # One booking per desk per slot, and one desk per user per slot.
+    # The booking routes rely on these instead of SELECT-then-INSERT.
+    # Released no-shows don't count, so their desk can be booked again.
+    __table_args__ = (
+        db.Index('uq_booking_desk_slot', 'desk_number', 'date', 'timeslot', 'floor', unique=True,
+                 sqlite_where=text(HOLDS_DESK), postgresql_where=text(HOLDS_DESK)),
+        db.Index('uq_booking_user_slot', 'user_id', 'date', 'timeslot', unique=True,
+                 sqlite_where=text(HOLDS_DESK), postgresql_where=text(HOLDS_DESK)),
+        db.Index('ix_booking_slot_floor', 'date', 'timeslot', 'floor'),
+        db.Index('ix_booking_user_starts', 'user_id', 'starts_at'),
+        db.Index('ix_booking_status_ends', 'status', 'ends_at'),
+    )
+
+
+@event.listens_for(Booking, "before_insert")
+@event.listens_for(Booking, "before_update")
+def _set_booking_window(mapper, connection, target):
+    if target.date is not None and target.timeslot:
+        target.starts_at, target.ends_at = slot_window(target.date, target.timeslot, connection)
+
 
 
 class ActivityLog(db.Model):
@@ -81,10 +192,114 @@ class ActivityLog(db.Model):
     event = db.Column(db.String(80), nullable=False)
     details = db.Column(db.String(500), nullable=True)
     ip_address = db.Column(db.String(100), nullable=True)
+    occurrences = db.Column(db.Integer, default=1)   # >1 when repeats were coalesced into this row
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='activity_logs', lazy=True)
     device = db.relationship('Device', backref='activity_logs', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_activity_log_event_time', 'event', 'created_at'),
+        db.Index('ix_activity_log_device_time', 'device_id', 'created_at'),
+        db.Index('ix_activity_log_user', 'user_id'),
+        db.Index('ix_activity_log_created', 'created_at'),
+    )
+
     def __repr__(self):
         return f"<ActivityLog {self.event} user={self.user_id} device={self.device_id}>"
+
+
+class EventCounter(db.Model):
+    # Per-day rollup of ActivityLog, maintained by utils/counters.py as events are written.
+    event = db.Column(db.String(80), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Alert(db.Model):
+    # Raised in real time by utils/anomaly.py when a device breaks a sliding-window rule.
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    rule = db.Column(db.String(80), nullable=False)
+    message = db.Column(db.String(300), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # alerts go with their device (device_id is NOT NULL, so they can't be orphaned)
+    device = db.relationship('Device', lazy=True,
+                             backref=db.backref('alerts', lazy=True, cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.Index('ix_alert_device_time', 'device_id', 'created_at'),
+    )
+
+
+# ---------------------------------------------------
+# ARCHIVE (see utils/archive.py)
+# ---------------------------------------------------
+# Same columns as the live tables, without foreign keys so history outlives
+# deleted devices. Rows keep their original ids.
+class BookingArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    desk_number = db.Column(db.String(80), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    timeslot = db.Column(db.String(30), nullable=False)
+    floor = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20))
+    session_start = db.Column(db.DateTime, nullable=True)
+    session_end = db.Column(db.DateTime, nullable=True)
+    starts_at = db.Column(db.DateTime, nullable=True)
+    ends_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_booking_archive_user_starts', 'user_id', 'starts_at'),
+    )
+
+
+class ActivityLogArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    device_id = db.Column(db.Integer, nullable=True)
+    event = db.Column(db.String(80), nullable=False)
+    details = db.Column(db.String(500), nullable=True)
+    ip_address = db.Column(db.String(100), nullable=True)
+    occurrences = db.Column(db.Integer, default=1)
+    created_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_activity_log_archive_device_time', 'device_id', 'created_at'),
+        db.Index('ix_activity_log_archive_user', 'user_id'),
+    )
+
+
+class ArchiveRun(db.Model):
+    # Audit trail: one row per table per archive pass that moved something.
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(50), nullable=False)        # "booking" / "activity_log"
+    cutoff = db.Column(db.DateTime, nullable=False)          # rows older than this were moved
+    moved = db.Column(db.Integer, nullable=False, default=0)
+    first_id = db.Column(db.Integer, nullable=True)
+    last_id = db.Column(db.Integer, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class OutboundMail(db.Model):
+    # Persistent mail queue drained by utils/emailer.py; rows survive restarts.
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="Pending")   # Pending / Sent / Failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(300), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbound_mail_status_next', 'status', 'next_attempt_at'),
+    )
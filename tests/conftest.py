@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app          # noqa: E402
+from models import db               # noqa: E402
+from utils import logging as activity_log   # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App on a throwaway SQLite file; no background sweeper."""
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'deskhop.db'}",
+        "BOOKING_LIFECYCLE": False,
+        "MAIL_BACKEND": "file",
+        "MAIL_FILE_DIR": str(tmp_path / "mail"),
+    })
+    with app.app_context():
+        yield app
+        activity_log.shutdown()      # the writer thread is bound to this app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as a fresh, approved user on a migrated database."""
+    from migrations import upgrade
+    from models import User
+
+    upgrade()
+    user = User(username="alice", email="alice@x", password_hash="x", is_verified=True, is_approved=True)
+    db.session.add(user)
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["_user_id"] = str(user.id)
+        s["_fresh"] = True
+    return client
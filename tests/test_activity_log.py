@@ -0,0 +1,86 @@
+import time
+from sqlalchemy import func
+from models import db, ActivityLog
+from utils import coalesce, logging as activity_log
+
+
+def _occurrences(event):
+    return db.session.query(func.coalesce(func.sum(ActivityLog.occurrences), 0)) \
+                     .filter(ActivityLog.event == event).scalar()
+
+
+def _post_repeats(client, event, n):
+    r = client.post("/booking/api/log_event", json={"events": [{"event": event}] * n})
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def test_held_repeat_is_swept_by_the_writer_without_further_requests(client, monkeypatch):
+    monkeypatch.setattr(coalesce, "REFILL_PER_SEC", 100.0)
+    monkeypatch.setattr(coalesce, "SWEEP_INTERVAL", 0.0)
+    body = _post_repeats(client, "test_swept", coalesce.BUCKET_CAPACITY + 1)
+    assert body["coalesced"] == 1
+
+    deadline = time.monotonic() + 5
+    while _occurrences("test_swept") < coalesce.BUCKET_CAPACITY + 1 and time.monotonic() < deadline:
+        time.sleep(0.1)
+        db.session.remove()
+    assert _occurrences("test_swept") == coalesce.BUCKET_CAPACITY + 1
+
+
+def test_held_repeats_are_written_at_shutdown(client):
+    body = _post_repeats(client, "test_drained", coalesce.BUCKET_CAPACITY + 3)
+    assert body["coalesced"] == 3
+
+    activity_log.shutdown()
+    db.session.remove()
+    assert _occurrences("test_drained") == coalesce.BUCKET_CAPACITY + 3
+    assert coalesce.pending() == 0
+
+
+def _resume_failures(n, device_id=42):
+    return [activity_log._row("resume_auth_failed", user_id=1, device_id=device_id) for _ in range(n)]
+
+
+def test_failed_batch_is_not_fed_to_the_detector_twice(client, monkeypatch):
+    from models import Alert
+    from utils import anomaly
+    anomaly.reset()
+    commit = db.session.commit
+    failures = [RuntimeError("batch commit failed")]
+
+    def flaky_commit():
+        if failures:
+            raise failures.pop()
+        commit()
+
+    monkeypatch.setattr(db.session, "commit", flaky_commit)
+    activity_log._write_batch(client.application, _resume_failures(2))
+    # two real failures stay below the threshold of 3, even though the batch was retried row by row
+    assert Alert.query.count() == 0
+
+    activity_log._write_batch(client.application, _resume_failures(1))
+    alert = Alert.query.one()
+    assert (alert.rule, alert.count) == ("resume_failures", 3)
+    anomaly.reset()
+
+
+def test_alert_that_could_not_be_saved_fires_again(client, monkeypatch):
+    from models import Alert
+    from utils import anomaly
+    anomaly.reset()
+    real_insert = activity_log.insert
+
+    def no_alerts(table):
+        if table is Alert:
+            raise RuntimeError("alert insert failed")
+        return real_insert(table)
+
+    monkeypatch.setattr(activity_log, "insert", no_alerts)
+    activity_log._write_batch(client.application, _resume_failures(3))
+    assert Alert.query.count() == 0
+
+    monkeypatch.setattr(activity_log, "insert", real_insert)
+    activity_log._write_batch(client.application, _resume_failures(1))
+    assert Alert.query.one().count == 4
+    anomaly.reset()
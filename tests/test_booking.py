@@ -0,0 +1,59 @@
+from datetime import date, timedelta
+from models import Booking
+
+
+def _future_day():
+    return (date.today() + timedelta(days=7)).isoformat()
+
+
+def test_bulk_rejects_unknown_or_non_string_slots(client):
+    day = _future_day()
+    r = client.post("/booking/api/bookings/bulk", json={"atomic": False, "items": [
+        {"desk": "T4", "date": day, "slot": ["x"]},
+        {"desk": "T4", "date": day, "slot": "Slot 9"},
+        {"desk": "T4", "date": day, "slot": "Slot 1"},
+    ]})
+    assert r.status_code == 207
+    body = r.get_json()
+    assert [f["error"] for f in body["failed"]] == ["Unknown slot ['x']", "Unknown slot 'Slot 9'"]
+    assert [b.timeslot for b in Booking.query.all()] == ["Slot 1"]
+
+
+def test_bulk_recurrence_rejects_unknown_slot(client):
+    day = _future_day()
+    for slot in ("Slot 9", ["x"]):
+        r = client.post("/booking/api/bookings/bulk", json={"recurrence": {
+            "desk": "T4", "start": day, "end": day, "slot": slot}})
+        assert r.status_code == 400
+        assert "unknown slot" in r.get_json()["error"]
+    assert Booking.query.count() == 0
+
+
+def test_compat_honeypot_on_ended_slot_is_flagged(client):
+    from models import ActivityLog
+    from utils import logging as activity_log
+    past = (date.today() - timedelta(days=3)).isoformat()
+    r = client.post("/booking/api/bookings", json={"desk": "HP01", "date": past, "slot": "Slot 1", "floor": 1})
+    assert r.status_code == 403
+    activity_log.flush()
+    assert ActivityLog.query.filter_by(event="honeypot_triggered").count() == 1
+
+
+def test_availability_counts_only_bookable_desks_and_ends_past_slots(client):
+    from models import db, User
+    from utils import floors
+    day = date.today() + timedelta(days=7)
+    plan = floors.get(1)
+    for desk in ("T4", "HP01", "NOPE"):
+        user = User(username=desk, email=f"{desk}@x", password_hash="x")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Booking(user_id=user.id, desk_number=desk, date=day, timeslot="Slot 1", floor=1))
+    db.session.commit()
+
+    cell = client.get(f"/booking/api/availability?start={day}").get_json()["days"][day.isoformat()]["Slot 1"]["1"]
+    assert cell == {"capacity": plan.capacity, "booked": 1, "free": plan.capacity - 1, "ended": False}
+
+    past = date.today() - timedelta(days=1)
+    cell = client.get(f"/booking/api/availability?start={past}").get_json()["days"][past.isoformat()]["Slot 1"]["1"]
+    assert cell["ended"] and cell["free"] == 0
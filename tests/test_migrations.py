@@ -0,0 +1,33 @@
+import pytest
+from sqlalchemy import text
+from models import db, User
+from migrations import upgrade, applied_versions, check_query_plans, MIGRATIONS
+
+
+def test_upgrade_applies_every_migration(app):
+    upgrade()
+    assert applied_versions() == {version for version, _, _ in MIGRATIONS}
+    assert upgrade() == []
+
+
+def test_hot_queries_use_an_index(app):
+    upgrade()
+    assert check_query_plans() == {}
+
+
+def test_unique_booking_indexes_refuse_existing_duplicates(app):
+    upgrade()
+    db.session.add(User(username="a", email="a@x", password_hash="x"))
+    db.session.commit()
+    db.session.execute(text("DROP INDEX uq_booking_desk_slot"))
+    db.session.execute(text("DROP INDEX uq_booking_user_slot"))
+    db.session.execute(text("DELETE FROM schema_migrations WHERE version >= 2"))
+    for _ in range(2):
+        db.session.execute(text(
+            "INSERT INTO booking (user_id, desk_number, date, timeslot, floor, status) "
+            "VALUES (1, 'T1', '2025-01-01', 'Slot 1', 1, 'Upcoming')"))
+    db.session.commit()
+
+    with pytest.raises(RuntimeError, match="Duplicate bookings"):
+        upgrade()
+    assert 2 not in applied_versions()
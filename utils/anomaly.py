@@ -0,0 +1,114 @@
+from flask import current_app
+from datetime import datetime
+import threading
+
+# ---------------------------------------------------
+# SLIDING-WINDOW RULES
+# ---------------------------------------------------
+# Override with app.config["ANOMALY_RULES"] (same shape).
+# An alert fires when a device logs `threshold` or more `event`s within `window` seconds,
+# then stays quiet for that rule and device until a full window has passed.
+DEFAULT_RULES = [
+    {"name": "resume_failures", "event": "resume_auth_failed", "window": 3600, "threshold": 3,
+     "message": "{n} failed resume attempts last hour."},
+    {"name": "frequent_pauses", "event": "session_pause", "window": 3600, "threshold": 5,
+     "message": "{n} pauses last hour."},
+]
+
+SLOTS = 60               # ring buffer slots per window (1 minute each for a 1h window)
+MAX_WINDOWS = 100000     # bound on tracked (device, rule) pairs
+
+_lock = threading.Lock()
+_windows = {}            # (device_id, rule name) -> _Ring
+_last_alert = {}         # (device_id, rule name) -> epoch seconds of last alert
+
+
+class _Ring:
+    """Counts per time slot; slots older than the window are reused in place."""
+    __slots__ = ("width", "counts", "epochs")
+
+    def __init__(self, window):
+        self.width = window / SLOTS
+        self.counts = [0] * SLOTS
+        self.epochs = [-1] * SLOTS
+
+    def add(self, ts, n):
+        e = int(ts // self.width)
+        i = e % SLOTS
+        if self.epochs[i] != e:
+            self.epochs[i] = e
+            self.counts[i] = 0
+        self.counts[i] += n
+
+    def total(self, ts):
+        e = int(ts // self.width)
+        return sum(c for c, ep in zip(self.counts, self.epochs) if e - ep < SLOTS)
+
+
+def rules():
+    try:
+        return current_app.config.get("ANOMALY_RULES") or DEFAULT_RULES
+    except RuntimeError:
+        return DEFAULT_RULES
+
+
+def observe(rows):
+    """
+    Feed ActivityLog rows (dicts as queued by log_event) through the rules.
+    Returns a list of Alert row dicts for the caller to insert.
+    """
+    by_event = {}
+    for rule in rules():
+        by_event.setdefault(rule["event"], []).append(rule)
+
+    alerts = []
+    with _lock:
+        for r in rows:
+            device_id = r.get("device_id")
+            matching = by_event.get(r.get("event"))
+            if not device_id or not matching:
+                continue
+
+            created = r.get("created_at") or datetime.utcnow()
+            ts = created.timestamp()
+            for rule in matching:
+                key = (device_id, rule["name"])
+                ring = _windows.get(key)
+                if ring is None:
+                    if len(_windows) >= MAX_WINDOWS:
+                        _windows.clear()
+                        _last_alert.clear()
+                    ring = _windows[key] = _Ring(rule["window"])
+                ring.add(ts, r.get("occurrences") or 1)
+
+                n = ring.total(ts)
+                if n < rule["threshold"]:
+                    continue
+                if ts - _last_alert.get(key, float("-inf")) < rule["window"]:
+                    continue
+
+                _last_alert[key] = ts
+                alerts.append({
+                    "device_id": device_id,
+                    "user_id": r.get("user_id"),
+                    "rule": rule["name"],
+                    "message": rule["message"].format(n=n),
+                    "count": n,
+                    "created_at": created,
+                })
+    return alerts
+
+
+def retract(alerts):
+    """Forget that `alerts` (as returned by observe) fired, e.g. when they could not be saved."""
+    with _lock:
+        for a in alerts:
+            key = (a["device_id"], a["rule"])
+            if _last_alert.get(key) == a["created_at"].timestamp():
+                del _last_alert[key]
+
+
+def reset():
+    with _lock:
+        _windows.clear()
+        _last_alert.clear()
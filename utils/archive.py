@@ -0,0 +1,114 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete
+from models import db, Booking, ActivityLog, BookingArchive, ActivityLogArchive, ArchiveRun
+
+# ---------------------------------------------------
+# ARCHIVAL OF OLD BOOKINGS AND LOGS
+# ---------------------------------------------------
+# Finished bookings (Completed / Released) whose slot ended more than
+# BOOKING_RETENTION_DAYS ago, and ActivityLog rows older than LOG_RETENTION_DAYS,
+# are moved to booking_archive / activity_log_archive in id batches:
+# INSERT ... SELECT + DELETE in one transaction per batch, together with the
+# ArchiveRun audit row, so a crash never loses or duplicates a row.
+# Per-day counters (EventCounter) and Alerts stay, so dashboards keep their trends.
+BOOKING_RETENTION_DAYS = 90     # app.config["ARCHIVE_BOOKING_DAYS"]; 0 disables
+LOG_RETENTION_DAYS = 30         # app.config["ARCHIVE_LOG_DAYS"]; 0 disables
+BATCH_SIZE = 1000
+RUN_INTERVAL = 6 * 3600         # seconds between sweeper-driven passes; app.config["ARCHIVE_INTERVAL"]
+
+_lock = threading.Lock()
+_last_run = 0.0
+_stats = {"runs": 0, "bookings": 0, "logs": 0, "last_run": None}
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+def _move(src, dst, where, cutoff, source):
+    names = [c.name for c in dst.__table__.columns]
+    src_cols = [src.__table__.c[name] for name in names]
+    run = None
+    moved = 0
+
+    while True:
+        ids = [r[0] for r in db.session.execute(select(src.id).where(*where).limit(BATCH_SIZE))]
+        if not ids:
+            break
+
+        db.session.execute(insert(dst).from_select(names, select(*src_cols).where(src.id.in_(ids))))
+        db.session.execute(delete(src).where(src.id.in_(ids)).execution_options(synchronize_session=False))
+
+        if run is None:
+            run = ArchiveRun(source=source, cutoff=cutoff, moved=0,
+                             first_id=min(ids), last_id=max(ids), started_at=datetime.utcnow())
+            db.session.add(run)
+        run.moved += len(ids)
+        run.first_id = min(run.first_id, min(ids))
+        run.last_id = max(run.last_id, max(ids))
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+        moved += len(ids)
+
+        if len(ids) < BATCH_SIZE:
+            break
+    return moved
+
+
+def run(now=None, config=None):
+    """
+    Move everything past its retention into the archive tables.
+    Returns {"bookings": n, "logs": n}. Needs an app context.
+    """
+    now = now or datetime.utcnow()
+    config = config or {}
+    booking_days = config.get("ARCHIVE_BOOKING_DAYS", BOOKING_RETENTION_DAYS)
+    log_days = config.get("ARCHIVE_LOG_DAYS", LOG_RETENTION_DAYS)
+    out = {"bookings": 0, "logs": 0}
+
+    try:
+        if booking_days:
+            cutoff = now - timedelta(days=booking_days)
+            out["bookings"] = _move(Booking, BookingArchive,
+                                    [Booking.status.in_(["Completed", "Released"]), Booking.ends_at < cutoff],
+                                    cutoff, "booking")
+        if log_days:
+            cutoff = now - timedelta(days=log_days)
+            out["logs"] = _move(ActivityLog, ActivityLogArchive,
+                                [ActivityLog.created_at < cutoff],
+                                cutoff, "activity_log")
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        with _lock:
+            _stats["runs"] += 1
+            _stats["bookings"] += out["bookings"]
+            _stats["logs"] += out["logs"]
+            _stats["last_run"] = now.isoformat()
+    return out
+
+
+def maybe_run(config=None):
+    """run() at most once per ARCHIVE_INTERVAL seconds (called from the lifecycle sweeper)."""
+    global _last_run
+    config = config or {}
+    now = time.monotonic()
+    with _lock:
+        if _last_run and now - _last_run < config.get("ARCHIVE_INTERVAL", RUN_INTERVAL):
+            return None
+        _last_run = now
+    return run(config=config)
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app()
+
+    with app.app_context():
+        result = run(config=app.config)
+        print(f"✅ Archived {result['bookings']} bookings and {result['logs']} log rows")
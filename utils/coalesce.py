@@ -0,0 +1,93 @@
+import threading
+import time
+
+# ---------------------------------------------------
+# PER-USER, PER-EVENT TOKEN BUCKETS
+# ---------------------------------------------------
+# Each (user_id, event) key may write BUCKET_CAPACITY rows in a burst and then
+# one row every 1 / REFILL_PER_SEC seconds. Repeats beyond that are not dropped:
+# they are counted and folded into the next row written for the same key.
+BUCKET_CAPACITY = 5
+REFILL_PER_SEC = 0.2
+SWEEP_INTERVAL = 1.0      # seconds between sweeps of pending repeats
+IDLE_EVICT = 600          # forget keys idle this long with nothing pending
+MAX_KEYS = 50000
+
+_lock = threading.Lock()
+_buckets = {}             # key -> [tokens, last_refill, pending_count, pending_meta, last_seen]
+_last_sweep = 0.0
+
+
+def _refill(b, now):
+    b[0] = min(BUCKET_CAPACITY, b[0] + (now - b[1]) * REFILL_PER_SEC)
+    b[1] = now
+
+
+def admit(key, count=1, meta=None, now=None):
+    """
+    Charge one token for `count` occurrences of an event.
+    Returns the number of occurrences the caller should write now (including any
+    repeats held back earlier), or 0 if they were held back. `meta` (e.g. the
+    log_event kwargs of the latest occurrence) is returned by sweep() with the repeats.
+    """
+    now = now or time.monotonic()
+    with _lock:
+        b = _buckets.get(key)
+        if b is None:
+            if len(_buckets) >= MAX_KEYS:
+                return count   # table full: don't coalesce rather than grow
+            b = _buckets[key] = [BUCKET_CAPACITY, now, 0, None, now]
+        _refill(b, now)
+        b[4] = now
+
+        if b[0] >= 1:
+            b[0] -= 1
+            total = count + b[2]
+            b[2] = 0
+            return total
+
+        b[2] += count
+        b[3] = meta
+        return 0
+
+
+def sweep(now=None):
+    """
+    Release held-back repeats whose bucket has refilled.
+    Returns [(key, count, meta), ...]; runs at most once per SWEEP_INTERVAL.
+    """
+    global _last_sweep
+    now = now or time.monotonic()
+    out = []
+    with _lock:
+        if now - _last_sweep < SWEEP_INTERVAL:
+            return out
+        _last_sweep = now
+
+        for key in list(_buckets):
+            b = _buckets[key]
+            _refill(b, now)
+            if b[2] and b[0] >= 1:
+                b[0] -= 1
+                out.append((key, b[2], b[3]))
+                b[2] = 0
+            elif not b[2] and now - b[4] > IDLE_EVICT:
+                del _buckets[key]
+    return out
+
+
+def drain():
+    """Release every held-back repeat, refilled or not (shutdown). Returns [(key, count, meta), ...]."""
+    out = []
+    with _lock:
+        for key, b in _buckets.items():
+            if b[2]:
+                out.append((key, b[2], b[3]))
+                b[2] = 0
+    return out
+
+
+def pending():
+    """Total held-back occurrences across all keys (for monitoring)."""
+    with _lock:
+        return sum(b[2] for b in _buckets.values())
@@ -0,0 +1,83 @@
+from models import db, EventCounter, ActivityLog
+from datetime import datetime, timedelta
+from collections import Counter
+from sqlalchemy import func
+from sqlalchemy.dialects import sqlite, postgresql
+
+
+def _upsert(dialect_name):
+    if dialect_name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def record(rows):
+    """
+    Add ActivityLog rows (dicts as queued by log_event) to the per-day counters.
+    Runs in the caller's transaction; the caller commits.
+    """
+    bumps = Counter()
+    for r in rows:
+        day = (r.get("created_at") or datetime.utcnow()).date()
+        bumps[(r["event"], day)] += r.get("occurrences") or 1
+    if not bumps:
+        return
+
+    insert = _upsert(db.engine.dialect.name)
+    for (event, day), n in bumps.items():
+        stmt = insert(EventCounter).values(event=event, day=day, count=n)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[EventCounter.event, EventCounter.day],
+            set_={"count": EventCounter.count + stmt.excluded.count}
+        )
+        db.session.execute(stmt)
+
+
+def summary(events, today=None):
+    """
+    {event: {"total", "today", "yesterday", "week", "prev_week"}} from the rollup table.
+    Reads at most one row per event per day; never touches ActivityLog.
+    """
+    today = today or datetime.utcnow().date()
+    week_start = today - timedelta(days=6)
+    prev_start = week_start - timedelta(days=7)
+    yesterday = today - timedelta(days=1)
+
+    out = {e: {"total": 0, "today": 0, "yesterday": 0, "week": 0, "prev_week": 0} for e in events}
+
+    totals = db.session.query(EventCounter.event, func.sum(EventCounter.count)) \
+                       .filter(EventCounter.event.in_(events)) \
+                       .group_by(EventCounter.event).all()
+    for event, n in totals:
+        out[event]["total"] = int(n or 0)
+
+    recent = EventCounter.query.filter(
+        EventCounter.event.in_(events),
+        EventCounter.day >= prev_start
+    ).all()
+    for c in recent:
+        s = out[c.event]
+        if c.day == today:
+            s["today"] += c.count
+        elif c.day == yesterday:
+            s["yesterday"] += c.count
+        if c.day >= week_start:
+            s["week"] += c.count
+        else:
+            s["prev_week"] += c.count
+
+    return out
+
+
+def rebuild():
+    """Recompute every counter from ActivityLog (used by the backfill migration)."""
+    day = func.date(ActivityLog.created_at)
+    rows = db.session.query(ActivityLog.event, day, func.sum(func.coalesce(ActivityLog.occurrences, 1))) \
+                     .group_by(ActivityLog.event, day).all()
+    EventCounter.query.delete()
+    for event, d, n in rows:
+        if d is None:
+            continue
+        if isinstance(d, str):
+            d = datetime.strptime(d, "%Y-%m-%d").date()
+        db.session.add(EventCounter(event=event, day=d, count=int(n)))
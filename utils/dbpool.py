@@ -0,0 +1,84 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# ---------------------------------------------------
+# CONNECTION POOL METRICS + SQLITE PRAGMAS
+# ---------------------------------------------------
+# TimedQueuePool is QueuePool plus counters: how long callers waited for a
+# connection, how often they timed out, and how long connections stayed checked out.
+# install() adds the per-connection SQLite pragmas: WAL lets readers run while a
+# writer commits, busy_timeout makes a blocked writer wait instead of failing
+# with "database is locked", synchronous=NORMAL is safe under WAL.
+
+_lock = threading.Lock()
+_stats = {"checkouts": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+          "held_ms_total": 0.0, "held_ms_max": 0.0, "in_use": 0, "in_use_max": 0}
+_pool = None
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            with _lock:
+                _stats["timeouts"] += 1
+            raise
+        waited = (time.perf_counter() - started) * 1000
+        with _lock:
+            _stats["checkouts"] += 1
+            _stats["wait_ms_total"] += waited
+            _stats["wait_ms_max"] = max(_stats["wait_ms_max"], waited)
+            _stats["in_use"] += 1
+            _stats["in_use_max"] = max(_stats["in_use_max"], _stats["in_use"])
+        conn._checked_out_at = time.perf_counter()
+        return conn
+
+    def _do_return_conn(self, record):
+        held = (time.perf_counter() - getattr(record, "_checked_out_at", time.perf_counter())) * 1000
+        with _lock:
+            _stats["in_use"] = max(0, _stats["in_use"] - 1)
+            _stats["held_ms_total"] += held
+            _stats["held_ms_max"] = max(_stats["held_ms_max"], held)
+        super()._do_return_conn(record)
+
+
+def stats():
+    """Pool counters plus the pool's own size/overflow snapshot."""
+    with _lock:
+        out = dict(_stats)
+    n = out["checkouts"] or 1
+    out["wait_ms_avg"] = round(out["wait_ms_total"] / n, 3)
+    out["held_ms_avg"] = round(out["held_ms_total"] / n, 3)
+    for key in ("wait_ms_total", "wait_ms_max", "held_ms_total", "held_ms_max"):
+        out[key] = round(out[key], 3)
+    if isinstance(_pool, QueuePool):
+        out["size"] = _pool.size()
+        out["checked_out"] = _pool.checkedout()
+        out["overflow"] = _pool.overflow()
+    return out
+
+
+def install(engine, config=None):
+    """Hook the engine: SQLite pragmas on every new connection, pool stats."""
+    global _pool
+    config = config or {}
+    _pool = engine.pool
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    busy_timeout = int(config.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    mmap_size = int(config.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+        cur.execute("PRAGMA journal_mode = WAL")
+        cur.execute("PRAGMA synchronous = NORMAL")
+        cur.execute(f"PRAGMA mmap_size = {mmap_size}")
+        cur.close()
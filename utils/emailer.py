@@ -1,16 +1,242 @@
+import os
 import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
 from email.mime.text import MIMEText
+from flask import current_app
+from models import db, OutboundMail
 
 SENDER_EMAIL = "shashwathip2005@gmail.com"
-APP_PASSWORD = "qbmq oxee vveh mepk"  # Generate from Google account
+
+# ---------------------------------------------------
+# OUTBOUND MAIL QUEUE
+# ---------------------------------------------------
+# Requests only INSERT an OutboundMail row. One background worker drains due
+# rows over a single authenticated SMTP connection, kept open for IDLE_CLOSE
+# seconds between messages. Failures are retried with exponential backoff
+# (RETRY_BASE doubling per attempt, capped at RETRY_MAX) until MAX_ATTEMPTS.
+# Each row is claimed (next_attempt_at pushed out by CLAIM_LEASE) before it is
+# sent, so several worker processes never send the same message twice.
+#
+# MAIL_BACKEND selects the transport:
+#   "smtp"  MAIL_SERVER / MAIL_PORT / MAIL_USE_SSL / MAIL_USERNAME / MAIL_PASSWORD
+#           (a local debugging server is just MAIL_SERVER=localhost, MAIL_PORT=1025,
+#           MAIL_USE_SSL=0 and no username)
+#   "file"  each message is written as a .eml file under MAIL_FILE_DIR
+#           (default instance/mail), for local runs and tests
+POLL_INTERVAL = 5.0
+IDLE_CLOSE = 60.0
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+RETRY_BASE = 30           # seconds
+RETRY_MAX = 3600
+CLAIM_LEASE = 300         # seconds a claimed row is hidden from other workers
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_worker = None
+_stats = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "connections": 0}
+
+
+def _count(key, n=1):
+    with _lock:
+        _stats[key] += n
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+# ---------------------------------------------------
+# TRANSPORTS
+# ---------------------------------------------------
+class SMTPTransport:
+    """Keeps one logged-in connection and reopens it when it drops or idles out."""
+
+    def __init__(self, config):
+        self.host = config.get("MAIL_SERVER", "smtp.gmail.com")
+        self.port = int(config.get("MAIL_PORT", 465))
+        self.use_ssl = config.get("MAIL_USE_SSL", True)
+        self.username = config.get("MAIL_USERNAME")
+        self.password = config.get("MAIL_PASSWORD")
+        self.timeout = config.get("MAIL_TIMEOUT", 20)
+        self._conn = None
+        self._last_used = 0.0
+
+    def _open(self):
+        cls = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        conn = cls(self.host, self.port, timeout=self.timeout)
+        if self.username:
+            conn.login(self.username, self.password or "")
+        _count("connections")
+        return conn
+
+    def send(self, sender, to_email, raw):
+        if self._conn is None:
+            self._conn = self._open()
+        try:
+            self._conn.sendmail(sender, [to_email], raw)
+        except smtplib.SMTPServerDisconnected:
+            # server closed the idle connection: reconnect once
+            self._conn = self._open()
+            self._conn.sendmail(sender, [to_email], raw)
+        self._last_used = time.monotonic()
+
+    def idle(self):
+        if self._conn is not None and time.monotonic() - self._last_used > IDLE_CLOSE:
+            self.close()
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except Exception:
+                pass
+            self._conn = None
+
+
+class FileTransport:
+    def __init__(self, config):
+        self.folder = config.get("MAIL_FILE_DIR") or os.path.join(current_app.instance_path, "mail")
+        os.makedirs(self.folder, exist_ok=True)
+
+    def send(self, sender, to_email, raw):
+        name = f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{to_email.replace('/', '_')}.eml"
+        with open(os.path.join(self.folder, name), "w", encoding="utf-8") as fh:
+            fh.write(raw)
+
+    def idle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _transport(config):
+    backend = config.get("MAIL_BACKEND") or ("smtp" if config.get("MAIL_PASSWORD") else "file")
+    return SMTPTransport(config) if backend == "smtp" else FileTransport(config)
+
+
+# ---------------------------------------------------
+# WORKER
+# ---------------------------------------------------
+def _backoff(attempts):
+    return timedelta(seconds=min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1)))
+
+
+def drain(transport, config, now=None):
+    """Send every due Pending row once. Returns the number sent. Needs an app context."""
+    sender = config.get("MAIL_SENDER", SENDER_EMAIL)
+    sent = 0
+    while True:
+        rows = OutboundMail.query.filter(OutboundMail.status == "Pending",
+                                         OutboundMail.next_attempt_at <= (now or datetime.utcnow())) \
+                                 .order_by(OutboundMail.next_attempt_at) \
+                                 .limit(BATCH_SIZE).all()
+        if not rows:
+            return sent
+
+        for m in rows:
+            claimed = db.session.execute(
+                update(OutboundMail)
+                .where(OutboundMail.id == m.id, OutboundMail.status == "Pending",
+                       OutboundMail.next_attempt_at == m.next_attempt_at)
+                .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=CLAIM_LEASE))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                continue   # another worker has it
+
+            msg = MIMEText(m.body)
+            msg["Subject"] = m.subject
+            msg["From"] = sender
+            msg["To"] = m.to_email
+            m.attempts += 1
+            try:
+                transport.send(sender, m.to_email, msg.as_string())
+                m.status = "Sent"
+                m.sent_at = datetime.utcnow()
+                m.last_error = None
+                sent += 1
+                _count("sent")
+            except Exception as e:
+                transport.close()
+                m.last_error = str(e)[:300]
+                if m.attempts >= MAX_ATTEMPTS:
+                    m.status = "Failed"
+                    _count("failed")
+                else:
+                    m.next_attempt_at = datetime.utcnow() + _backoff(m.attempts)
+                    _count("retried")
+            db.session.commit()
+
+        if len(rows) < BATCH_SIZE:
+            return sent
+
+
+def _run(app):
+    with app.app_context():
+        transport = _transport(app.config)
+        while not _stop.is_set():
+            _wake.clear()
+            try:
+                drain(transport, app.config)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Mail queue drain failed")
+            finally:
+                db.session.remove()
+            transport.idle()
+            _wake.wait(POLL_INTERVAL)
+        transport.close()
+
+
+def ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        app = current_app._get_current_object()
+        _stop.clear()
+        _worker = threading.Thread(target=_run, args=(app,), name="mail-sender", daemon=True)
+        _worker.start()
+
+
+def shutdown():
+    global _worker
+    _stop.set()
+    _wake.set()
+    if _worker is not None:
+        _worker.join(timeout=10)
+    _worker = None
+
+
+def init(app):
+    """Start the worker with the first request, so mail left over from a restart goes out."""
+    app.before_request(ensure_worker)
+
+
+# ---------------------------------------------------
+# API
+# ---------------------------------------------------
+def queue_mail(to_email, subject, body):
+    """Persist a message and wake the sender; returns immediately."""
+    mail = OutboundMail(to_email=to_email, subject=subject, body=body)
+    db.session.add(mail)
+    db.session.commit()
+    _count("queued")
+    ensure_worker()
+    _wake.set()
+    return mail
+
 
 def send_verification_email(to_email, verification_link):
-    msg = MIMEText(f"Click to verify your account:\n\n{verification_link}")
-    msg["Subject"] = "Verify Your Deskhop Account"
-    msg["From"] = SENDER_EMAIL
-    msg["To"] = to_email
-
-    server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
-    server.login(SENDER_EMAIL, APP_PASSWORD)
-    server.sendmail(SENDER_EMAIL, [to_email], msg.as_string())
-    server.quit()
+    return queue_mail(to_email, "Verify Your Deskhop Account",
+                      f"Click to verify your account:\n\n{verification_link}")
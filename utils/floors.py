@@ -0,0 +1,203 @@
+import glob
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+
+# ---------------------------------------------------
+# FLOOR PLAN REGISTRY
+# ---------------------------------------------------
+# static/floors/floorN.html is read once and served from memory.
+# The files are re-checked (one stat each) at most every CHECK_INTERVAL seconds
+# and reloaded when their mtime changes.
+CHECK_INTERVAL = 2.0
+
+_FILE_RE = re.compile(r"^floor(\d+)\.html$")
+
+_lock = threading.Lock()
+_floors = {}          # floor_id -> FloorPlan
+_folder = None
+_last_check = 0.0
+
+
+class Desk:
+    """
+    One desk element from a floor file. `block` is the index of the enclosing
+    .block on the plan and `position` the desk's order inside it.
+    """
+    __slots__ = ("floor", "desk_id", "zone", "block", "position", "honeypot", "bookable")
+
+    def __init__(self, floor, desk_id, zone, block, position, honeypot, bookable):
+        self.floor = floor
+        self.desk_id = desk_id
+        self.zone = zone
+        self.block = block
+        self.position = position
+        self.honeypot = honeypot
+        self.bookable = bookable
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _DeskParser(HTMLParser):
+    """Collects .desk elements and the title of the .block each one sits in."""
+
+    def __init__(self, floor_id):
+        super().__init__()
+        self.floor_id = floor_id
+        self.desks = {}
+        self._stack = []          # one entry per open <div>: block index or None
+        self._blocks = []         # block index -> zone title
+        self._per_block = {}      # block index -> desks seen so far
+        self._in_title = False
+
+    def _block(self):
+        for b in reversed(self._stack):
+            if b is not None:
+                return b
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "div":
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+
+        if "block" in classes:
+            self._blocks.append(None)
+            self._stack.append(len(self._blocks) - 1)
+            return
+        self._stack.append(None)
+
+        if "title" in classes and self._block() is not None and self._blocks[self._block()] is None:
+            self._in_title = True
+        elif "desk" in classes and attrs.get("id"):
+            desk_id = attrs["id"].strip()
+            block = self._block()
+            position = self._per_block.get(block, 0)
+            self._per_block[block] = position + 1
+            honeypot = "honeypot" in classes or desk_id.upper().startswith("HP")
+            self.desks[desk_id] = Desk(
+                floor=self.floor_id,
+                desk_id=desk_id,
+                zone=self._blocks[block] if block is not None else None,
+                block=block,
+                position=position,
+                honeypot=honeypot,
+                bookable=not honeypot and "manager" not in classes
+            )
+
+    def handle_endtag(self, tag):
+        if tag == "div" and self._stack:
+            self._stack.pop()
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title and data.strip():
+            self._blocks[self._block()] = data.strip()
+            self._in_title = False
+
+
+class FloorPlan:
+    __slots__ = ("floor_id", "path", "html", "mtime", "etag", "desks", "capacity")
+
+    def __init__(self, floor_id, path, html, mtime):
+        self.floor_id = floor_id
+        self.path = path
+        self.html = html
+        self.mtime = mtime
+        self.etag = hashlib.sha1(html.encode("utf-8")).hexdigest()[:16]
+
+        parser = _DeskParser(floor_id)
+        parser.feed(html)
+        self.desks = parser.desks                      # desk_id -> Desk
+        self.capacity = sum(1 for d in self.desks.values() if d.bookable)
+
+    def zone_capacity(self):
+        out = {}
+        for d in self.desks.values():
+            if d.bookable:
+                out[d.zone] = out.get(d.zone, 0) + 1
+        return out
+
+    @property
+    def last_modified(self):
+        return datetime.fromtimestamp(int(self.mtime), tz=timezone.utc)
+
+
+def _read(floor_id, path):
+    mtime = os.path.getmtime(path)
+    with open(path, "r", encoding="utf-8") as fh:
+        html = fh.read()
+    plan = FloorPlan(floor_id, path, html, mtime)
+    if not plan.desks:
+        raise ValueError(f"{os.path.basename(path)} has no desk elements")
+    return plan
+
+
+def _scan(folder):
+    found = {}
+    for path in glob.glob(os.path.join(folder, "floor*.html")):
+        m = _FILE_RE.match(os.path.basename(path))
+        if m:
+            found[int(m.group(1))] = path
+    return found
+
+
+def _refresh(force=False):
+    """Load new floors, reload changed ones, drop deleted ones."""
+    global _last_check
+    now = time.monotonic()
+    if not force and now - _last_check < CHECK_INTERVAL:
+        return
+    _last_check = now
+
+    for floor_id, path in _scan(_folder).items():
+        current = _floors.get(floor_id)
+        try:
+            if current is None or os.path.getmtime(path) != current.mtime:
+                _floors[floor_id] = _read(floor_id, path)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            # keep serving the last good copy, if any
+            print(f"⚠️ Floor plan {path} not loaded: {e}")
+
+    for floor_id in list(_floors):
+        if not os.path.exists(_floors[floor_id].path):
+            del _floors[floor_id]
+
+
+def init(folder):
+    """Point the registry at static/floors and load every floor now."""
+    global _folder
+    with _lock:
+        _folder = folder
+        _floors.clear()
+        _refresh(force=True)
+
+
+def get(floor_id):
+    """Return the FloorPlan for floor_id, or None if there is no such floor."""
+    with _lock:
+        if _folder is None:
+            return None
+        _refresh()
+        return _floors.get(floor_id)
+
+
+def floor_ids():
+    with _lock:
+        if _folder is not None:
+            _refresh()
+        return sorted(_floors)
+
+
+def desk(floor_id, desk_id):
+    """O(1) lookup of a Desk; None if the floor or desk doesn't exist."""
+    plan = get(floor_id)
+    if plan is None:
+        return None
+    return plan.desks.get(str(desk_id))
@@ -0,0 +1,72 @@
+import threading
+import time
+from sqlalchemy.orm import make_transient_to_detached
+from models import db, User
+
+# ---------------------------------------------------
+# PER-PROCESS IDENTITY CACHE
+# ---------------------------------------------------
+# load_user() runs on every authenticated request. The user's columns are kept
+# here for TTL seconds and re-attached to the request session with
+# merge(load=False), which issues no SELECT; lazy relationships and writes on
+# current_user still work as usual.
+# Routes that change a user call invalidate_user; other processes see the
+# change within TTL seconds.
+TTL = 30                  # seconds; app.config["IDENTITY_CACHE_TTL"] (0 disables)
+MAX_ENTRIES = 10000
+
+_lock = threading.Lock()
+_users = {}               # user_id -> (expires, {column: value})
+_stats = {"user_hits": 0, "user_misses": 0}
+_COLUMNS = [c.key for c in User.__table__.columns]
+
+
+def stats():
+    with _lock:
+        return dict(_stats, users=len(_users))
+
+
+def _put(table, key, value, ttl):
+    now = time.monotonic()
+    with _lock:
+        if len(table) >= MAX_ENTRIES:
+            for k in [k for k, (exp, _) in table.items() if exp <= now]:
+                del table[k]
+            if len(table) >= MAX_ENTRIES:
+                table.clear()
+        table[key] = (now + ttl, value)
+
+
+def _get(table, key, hit, miss):
+    with _lock:
+        entry = table.get(key)
+        if entry and entry[0] > time.monotonic():
+            _stats[hit] += 1
+            return entry[1]
+        _stats[miss] += 1
+        return None
+
+
+def get_user(user_id, ttl=TTL):
+    """User for the login manager: from the cache when fresh, else one PK lookup."""
+    if ttl:
+        values = _get(_users, user_id, "user_hits", "user_misses")
+        if values is not None:
+            user = User(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None and ttl:
+        _put(_users, user_id, {k: getattr(user, k) for k in _COLUMNS}, ttl)
+    return user
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _users.clear()
@@ -0,0 +1,163 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from models import db, Booking
+from utils import occupancy, archive
+
+# ---------------------------------------------------
+# BOOKING LIFECYCLE SWEEPER
+# ---------------------------------------------------
+# One background thread moves bookings nobody will touch again:
+#   Upcoming, not started NO_SHOW_GRACE minutes after the slot began, or after
+#   the booking was made if that was later                           -> Released
+#   Active, still open COMPLETE_GRACE minutes after the slot ended   -> Completed
+# Each transition is a set-based UPDATE of at most BATCH_SIZE rows, driven by
+# the (status, ends_at) index, so mybookings only ever scans live rows.
+# Released bookings drop out of the partial unique indexes, so the desk can be
+# booked again for the rest of the slot; the release is pushed to live floor pages.
+# The same thread runs the archive pass (utils/archive.py) every few hours.
+SWEEP_INTERVAL = 60       # seconds between sweeps
+NO_SHOW_GRACE = 15        # minutes; app.config["BOOKING_NO_SHOW_GRACE"] overrides
+COMPLETE_GRACE = 0        # minutes; app.config["BOOKING_COMPLETE_GRACE"] overrides
+BATCH_SIZE = 500
+
+_lock = threading.Lock()
+_stop = threading.Event()
+_thread = None
+_app = None
+_stats = {"runs": 0, "released": 0, "completed": 0, "failed": 0,
+          "last_run": None, "last_duration_ms": None}
+
+
+def stats():
+    """Snapshot of sweeper counters."""
+    with _lock:
+        out = dict(_stats)
+    out["running"] = _thread is not None and _thread.is_alive()
+    return out
+
+
+def _release_batch(cutoff):
+    # pick the batch by id first so the UPDATE touches exactly the rows we publish
+    # grace runs from max(starts_at, created_at): a booking made mid-slot gets the full grace too
+    ids = select(Booking.id).where(Booking.status == "Upcoming",
+                                   Booking.starts_at <= cutoff,
+                                   db.or_(Booking.created_at.is_(None), Booking.created_at <= cutoff)) \
+                            .limit(BATCH_SIZE)
+    stmt = update(Booking).where(Booking.id.in_(ids), Booking.status == "Upcoming") \
+                          .values(status="Released") \
+                          .execution_options(synchronize_session=False)
+
+    if db.engine.dialect.update_returning:
+        rows = db.session.execute(stmt.returning(
+            Booking.id, Booking.date, Booking.timeslot, Booking.floor, Booking.desk_number)).all()
+    else:
+        rows = db.session.execute(select(Booking.id, Booking.date, Booking.timeslot,
+                                         Booking.floor, Booking.desk_number)
+                                  .where(Booking.id.in_(ids))).all()
+        db.session.execute(update(Booking).where(Booking.id.in_([r.id for r in rows]),
+                                                 Booking.status == "Upcoming")
+                                          .values(status="Released")
+                                          .execution_options(synchronize_session=False))
+    db.session.commit()
+    return rows
+
+
+def _complete_batch(cutoff):
+    ids = select(Booking.id).where(Booking.status == "Active",
+                                   Booking.ends_at <= cutoff).limit(BATCH_SIZE)
+    result = db.session.execute(update(Booking)
+                                .where(Booking.id.in_(ids), Booking.status == "Active")
+                                .values(status="Completed", session_end=Booking.ends_at)
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+
+def run_once(now=None, config=None):
+    """
+    Release no-shows and complete abandoned sessions up to `now` (naive UTC).
+    Returns {"released": n, "completed": n}. Needs an app context.
+    """
+    now = now or datetime.utcnow()
+    config = config or {}
+    no_show = timedelta(minutes=config.get("BOOKING_NO_SHOW_GRACE", NO_SHOW_GRACE))
+    complete = timedelta(minutes=config.get("BOOKING_COMPLETE_GRACE", COMPLETE_GRACE))
+    started = time.monotonic()
+
+    released = completed = 0
+    try:
+        while True:
+            rows = _release_batch(now - no_show)
+            for row in rows:
+                occupancy.remove_booking(row)
+            released += len(rows)
+            if len(rows) < BATCH_SIZE:
+                break
+
+        while True:
+            n = _complete_batch(now - complete)
+            completed += n
+            if n < BATCH_SIZE:
+                break
+    except Exception:
+        db.session.rollback()
+        with _lock:
+            _stats["failed"] += 1
+        raise
+    finally:
+        with _lock:
+            _stats["runs"] += 1
+            _stats["released"] += released
+            _stats["completed"] += completed
+            _stats["last_run"] = now.isoformat()
+            _stats["last_duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+    return {"released": released, "completed": completed}
+
+
+def _run(app):
+    while not _stop.is_set():
+        with app.app_context():
+            try:
+                run_once(config=app.config)
+            except Exception:
+                app.logger.exception("Booking lifecycle sweep failed")
+            try:
+                archive.maybe_run(app.config)
+            except Exception:
+                app.logger.exception("Archive pass failed")
+            finally:
+                db.session.remove()
+        _stop.wait(app.config.get("BOOKING_SWEEP_INTERVAL", SWEEP_INTERVAL))
+
+
+def ensure_started():
+    """Start the sweeper thread if it isn't running (called before each request)."""
+    global _thread
+    if _app is None or (_thread is not None and _thread.is_alive()):
+        return
+    if not _app.config.get("BOOKING_LIFECYCLE", True):
+        return
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _stop.clear()
+        _thread = threading.Thread(target=_run, args=(_app,), name="booking-lifecycle", daemon=True)
+        _thread.start()
+
+
+def init(app):
+    """Attach the sweeper to the app; it starts with the first request."""
+    global _app
+    _app = app
+    app.before_request(ensure_started)
+
+
+def shutdown():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=10)
+    _thread = None
@@ -1,26 +1,200 @@
 from flask import request, current_app
-from models import db, ActivityLog
+from models import db, ActivityLog, Alert
 from datetime import datetime
+from sqlalchemy import insert
+from utils import counters, anomaly, coalesce
+import atexit
+import queue
+import threading
+import time
 
-def log_event(event: str, user_id=None, device_id=None, details=None, ip=None):
+# ---------------------------------------------------
+# BUFFERED WRITER SETTINGS
+# ---------------------------------------------------
+# Events are queued in memory and inserted by one background thread,
+# BATCH_SIZE rows per commit or every FLUSH_INTERVAL seconds, whichever first.
+# The same thread releases repeats held back by utils/coalesce.py (keys are
+# (user_id, event), meta the log_event kwargs) and writes any still held at shutdown.
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+MAX_QUEUE = 10000        # bounded memory; beyond this events are dropped
+PUT_TIMEOUT = 0.05       # how long a request may wait on a full queue (backpressure)
+
+_queue = queue.Queue(maxsize=MAX_QUEUE)
+_stop = threading.Event()
+_lock = threading.Lock()
+_writer = None
+_stats = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0, "failed": 0}
+
+
+def _count(key, n=1):
+    with _lock:
+        _stats[key] += n
+
+
+def stats():
+    """Snapshot of writer counters (enqueued / written / dropped / batches / failed)."""
+    with _lock:
+        out = dict(_stats)
+    out["queued"] = _queue.qsize()
+    return out
+
+
+def _persist(rows):
+    # log rows and their per-day counters go in one transaction
+    db.session.execute(insert(ActivityLog), rows)
+    counters.record(rows)
+    db.session.commit()
+
+
+def _raise_alerts(rows):
+    # The detector keeps its windows in memory, which a rollback can't undo, so it
+    # only sees rows after they committed (and each row once, retries included).
+    alerts = anomaly.observe(rows)
+    if not alerts:
+        return
+    try:
+        db.session.execute(insert(Alert), alerts)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        anomaly.retract(alerts)
+        current_app.logger.exception("Alert insert failed (%d alerts)", len(alerts))
+
+
+def _write_batch(app, rows):
+    with app.app_context():
+        try:
+            _persist(rows)
+        except Exception:
+            db.session.rollback()
+            if len(rows) == 1:
+                _count("failed")
+                app.logger.exception("ActivityLog insert failed")
+                return
+            app.logger.warning("ActivityLog batch insert failed (%d rows); retrying row by row", len(rows))
+        else:
+            _count("written", len(rows))
+            _count("batches")
+            _raise_alerts(rows)
+            return
+
+        # one bad row must not take the rest of the batch (other users' security events) with it
+        written = []
+        for row in rows:
+            try:
+                _persist([row])
+                _count("written")
+                written.append(row)
+            except Exception:
+                db.session.rollback()
+                _count("failed")
+                app.logger.exception("ActivityLog insert failed for event %r", row.get("event"))
+        _raise_alerts(written)
+
+
+def _row(event, user_id=None, device_id=None, details=None, ip=None, occurrences=1):
+    return {
+        "user_id": user_id,
+        "device_id": device_id,
+        "event": event[:80],
+        "details": details[:500] if isinstance(details, str) else details,   # column widths
+        "ip_address": ip,
+        "occurrences": occurrences,
+        "created_at": datetime.utcnow()
+    }
+
+
+def _write_released(app, released):
+    if released:
+        _write_batch(app, [_row(event, user_id=user_id, occurrences=n, **(meta or {}))
+                           for (user_id, event), n, meta in released])
+
+
+def _run(app):
+    while True:
+        try:
+            first = _queue.get(timeout=FLUSH_INTERVAL)
+        except queue.Empty:
+            if _stop.is_set():
+                _write_released(app, coalesce.drain())
+                return
+            _write_released(app, coalesce.sweep())
+            continue
+
+        rows = [first]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(rows) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        _write_batch(app, rows)
+        for _ in rows:
+            _queue.task_done()
+        _write_released(app, coalesce.sweep())
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _lock:
+        if _writer is not None and _writer.is_alive():
+            return
+        app = current_app._get_current_object()
+        _stop.clear()
+        _writer = threading.Thread(target=_run, args=(app,), name="activity-log-writer", daemon=True)
+        _writer.start()
+
+
+def flush():
+    """Block until every queued event has been written."""
+    if _writer is not None and _writer.is_alive():
+        _queue.join()
+
+
+@atexit.register
+def shutdown():
+    """Drain the queue, write held-back repeats and stop the writer thread."""
+    global _writer
+    if _writer is None:
+        return
+    _stop.set()
+    _writer.join(timeout=10)
+    _writer = None
+
+
+def log_event(event: str, user_id=None, device_id=None, details=None, ip=None, occurrences=1):
     """
     Log event to ActivityLog table.
     Keep calls small and consistent:
       log_event("session_pause", user_id=current_user.id, device_id=dev.id, details="fullscreen escape")
+
+    The row is queued and written in a batch by the background writer, so the
+    request doesn't pay for a commit. Set ACTIVITY_LOG_SYNC = True in the app
+    config to write inline instead. occurrences > 1 records coalesced repeats in one row.
     """
     try:
         ip_addr = ip or (request.remote_addr if request else None)
     except Exception:
         ip_addr = None
 
-    entry = ActivityLog(
-        user_id=user_id,
-        device_id=device_id,
-        event=event,
-        details=details,
-        ip_address=ip_addr,
-        created_at=datetime.utcnow()
-    )
-    db.session.add(entry)
-    db.session.commit()
-    return entry
+    row = _row(event, user_id, device_id, details, ip_addr, occurrences)
+
+    if current_app.config.get("ACTIVITY_LOG_SYNC"):
+        _persist([row])
+        _raise_alerts([row])
+        return row
+
+    _ensure_writer()
+    try:
+        _queue.put(row, timeout=PUT_TIMEOUT)
+        _count("enqueued")
+    except queue.Full:
+        _count("dropped")
+    return row
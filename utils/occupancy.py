@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+from models import db, Booking, User
+from utils import pubsub
+
+# Max number of (date, slot, floor) maps kept per process.
+# Least recently used keys (usually old dates) are evicted first.
+MAX_KEYS = 512
+# Seconds a loaded map is served before it is re-read. Writes in this process
+# update it immediately; this bounds how long other workers' bookings,
+# cancellations and releases stay invisible here.
+TTL = 10
+
+_lock = threading.Lock()
+_index = OrderedDict()   # (date, slot, floor) -> (expires, {desk: (user_id, booking_id, username)})
+_loading = {}            # key -> [ops list per in-flight _load]; writes during a load are replayed onto it
+
+
+def _key(date, slot, floor):
+    return (str(date), str(slot), int(floor))
+
+
+def _load(date, slot, floor):
+    # one joined query instead of Booking rows + lazy b.user per row
+    rows = db.session.query(Booking.desk_number, Booking.user_id, Booking.id, User.username) \
+                     .outerjoin(User, User.id == Booking.user_id) \
+                     .filter(Booking.date == date, Booking.timeslot == slot, Booking.floor == floor,
+                             Booking.status != "Released") \
+                     .all()
+    return {str(desk): (uid, bid, username) for desk, uid, bid, username in rows}
+
+
+def _apply(desks, op):
+    kind, desk, entry = op
+    if kind == "add":
+        desks[desk] = entry
+    elif desks.get(desk, (None, None))[1] == entry:
+        del desks[desk]
+
+
+def _record(key, op):
+    # caller holds _lock
+    cached = _index.get(key)
+    if cached is not None:
+        _apply(cached[1], op)
+    for ops in _loading.get(key, ()):
+        ops.append(op)
+
+
+def get_floor(date, slot, floor):
+    """
+    Return {desk: (user_id, booking_id, username)} for one date+slot+floor.
+    Served from memory; the database is hit when a key is first seen or older than TTL.
+    """
+    key = _key(date, slot, floor)
+    now = time.monotonic()
+    with _lock:
+        cached = _index.get(key)
+        if cached is not None and cached[0] > now:
+            _index.move_to_end(key)
+            return dict(cached[1])
+        ops = []
+        _loading.setdefault(key, []).append(ops)
+
+    try:
+        desks = _load(date, slot, floor)
+    finally:
+        with _lock:
+            pending = _loading[key]
+            pending.remove(ops)
+            if not pending:
+                del _loading[key]
+
+    with _lock:
+        # replay writes committed while the SELECT was running
+        for op in ops:
+            _apply(desks, op)
+        _index[key] = (time.monotonic() + TTL, desks)
+        _index.move_to_end(key)
+        while len(_index) > MAX_KEYS:
+            _index.popitem(last=False)
+        return dict(desks)
+
+
+def add_booking(booking, username=None):
+    """Record a committed booking and push it to live subscribers of that floor."""
+    key = _key(booking.date, booking.timeslot, booking.floor)
+    desk = str(booking.desk_number)
+    with _lock:
+        _record(key, ("add", desk, (booking.user_id, booking.id, username)))
+
+    pubsub.publish(key, {
+        "type": "created",
+        "desk": desk,
+        "booking": {
+            "name": username if username else str(booking.user_id),
+            "user_id": booking.user_id,
+            "slot": key[1],
+            "floor": key[2]
+        }
+    })
+
+
+def remove_booking(booking):
+    """Drop a deleted booking from the index and push the delete to live subscribers."""
+    key = _key(booking.date, booking.timeslot, booking.floor)
+    desk = str(booking.desk_number)
+    with _lock:
+        _record(key, ("remove", desk, booking.id))
+
+    pubsub.publish(key, {"type": "deleted", "desk": desk})
+
+
+def remove_user(user_id):
+    """Drop every cached booking held by a user (used when the user is deleted)."""
+    removed = []
+    with _lock:
+        for key, (_, desks) in _index.items():
+            for desk in [d for d, entry in desks.items() if entry[0] == user_id]:
+                del desks[desk]
+                removed.append((key, desk))
+
+    for key, desk in removed:
+        pubsub.publish(key, {"type": "deleted", "desk": desk})
+
+
+def clear():
+    with _lock:
+        _index.clear()
@@ -0,0 +1,76 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import or_, and_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor string, or None if it is missing/invalid."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        return None
+
+
+def page_limit(value):
+    try:
+        return max(1, min(MAX_LIMIT, int(value)))
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+
+
+def keyset_page(query, time_col, id_col, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    Newest-first page of `query` ordered by (time_col, id_col) descending.
+    Instead of OFFSET, the cursor carries the last (created_at, id) seen, so every
+    page is an index range read no matter how deep it is.
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    after = decode_cursor(cursor)
+    if after:
+        ts, row_id = after
+        query = query.filter(or_(time_col < ts, and_(time_col == ts, id_col < row_id)))
+
+    rows = query.order_by(time_col.desc(), id_col.desc()).limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, time_col.key), getattr(last, id_col.key))
+    return items, next_cursor
+
+
+def keyset_page_chain(sources, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    keyset_page over several (query, time_col, id_col) sources read one after the
+    other, e.g. a live table then its archive. Every row of a later source must be
+    older than every row of the earlier ones, so one cursor works across all of them.
+    """
+    items = []
+    for n, (query, time_col, id_col) in enumerate(sources):
+        if len(items) >= limit:
+            # page already full: only say "more" if a later source still has rows
+            for later in sources[n:]:
+                if keyset_page(later[0], later[1], later[2], cursor, 1)[0]:
+                    return items, cursor
+            return items, None
+        page, next_cursor = keyset_page(query, time_col, id_col, cursor, limit - len(items))
+        items.extend(page)
+        if next_cursor is not None:
+            return items, next_cursor
+        if items:
+            last = items[-1]
+            cursor = encode_cursor(getattr(last, time_col.key), getattr(last, id_col.key))
+    return items, None
@@ -0,0 +1,256 @@
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import argon2
+except ImportError:   # optional: pip install argon2-cffi
+    argon2 = None
+
+# ---------------------------------------------------
+# PASSWORD HASHING SERVICE
+# ---------------------------------------------------
+# PASSWORD_HASH_METHOD picks scheme and cost:
+#   "scrypt:32768:8:1"       werkzeug scrypt, N:r:p (the werkzeug default)
+#   "pbkdf2:sha256:600000"   werkzeug PBKDF2, iterations
+#   "argon2:3:65536:4"       argon2id time_cost:memory_kib:parallelism (needs argon2-cffi)
+# Hashes of any supported scheme verify; verify_and_update() rehashes on a
+# successful login when the stored scheme/cost differs from the configured one.
+#
+# KDF work runs on a pool of PASSWORD_HASH_WORKERS threads (hashlib and argon2
+# release the GIL), and at most PASSWORD_HASH_QUEUE calls may wait for it.
+# Beyond that callers get HasherBusy after QUEUE_TIMEOUT instead of piling up,
+# so a login burst can't tie up every request thread.
+#
+# Benchmark the cost settings on the target box with:
+#   python -m utils.passwords --bench
+DEFAULT_METHOD = "scrypt:32768:8:1"
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_QUEUE = 32
+QUEUE_TIMEOUT = 5.0
+
+_lock = threading.Lock()
+_stats = {"hashed": 0, "verified": 0, "rehashed": 0, "busy": 0, "kdf_ms_total": 0.0}
+
+
+class HasherBusy(RuntimeError):
+    """Raised when the hashing pool is saturated."""
+
+
+class WerkzeugHasher:
+    def __init__(self, method):
+        self.method = method
+        self._prefix = None
+
+    @property
+    def prefix(self):
+        # "scrypt:32768:8:1" etc. exactly as werkzeug writes it in front of the salt
+        if self._prefix is None:
+            self._prefix = generate_password_hash("x", self.method).split("$", 1)[0]
+        return self._prefix
+
+    def handles(self, stored):
+        return not stored.startswith("$argon2")
+
+    def hash(self, password):
+        return generate_password_hash(password, self.method)
+
+    def verify(self, stored, password):
+        return check_password_hash(stored, password)
+
+    def needs_rehash(self, stored):
+        return stored.split("$", 1)[0] != self.prefix
+
+
+class Argon2Hasher:
+    def __init__(self, method):
+        if argon2 is None:
+            raise RuntimeError("PASSWORD_HASH_METHOD=argon2 needs the argon2-cffi package")
+        parts = [int(x) for x in method.split(":")[1:]]
+        time_cost, memory_cost, parallelism = (parts + [3, 65536, 4][len(parts):])[:3]
+        self._ph = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost,
+                                         parallelism=parallelism)
+
+    def handles(self, stored):
+        return stored.startswith("$argon2")
+
+    def hash(self, password):
+        return self._ph.hash(password)
+
+    def verify(self, stored, password):
+        try:
+            return self._ph.verify(stored, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False
+
+    def needs_rehash(self, stored):
+        return not self.handles(stored) or self._ph.check_needs_rehash(stored)
+
+
+def make_hasher(method):
+    if method.startswith("argon2"):
+        return Argon2Hasher(method)
+    return WerkzeugHasher(method)
+
+
+_hasher = None
+_legacy = WerkzeugHasher(DEFAULT_METHOD)       # verifies werkzeug hashes when argon2 is configured
+_executor = None
+_slots = None
+
+
+def configure(config=None):
+    """(Re)build the hasher and the worker pool from app config."""
+    global _hasher, _executor, _slots
+    config = config or {}
+    workers = int(config.get("PASSWORD_HASH_WORKERS") or DEFAULT_WORKERS)
+    queue = int(config.get("PASSWORD_HASH_QUEUE") or DEFAULT_QUEUE)
+
+    with _lock:
+        _hasher = make_hasher(config.get("PASSWORD_HASH_METHOD") or DEFAULT_METHOD)
+        old = _executor
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        _slots = threading.BoundedSemaphore(workers + queue)
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def stats():
+    with _lock:
+        out = dict(_stats)
+    n = out["hashed"] + out["verified"]
+    out["kdf_ms_avg"] = round(out["kdf_ms_total"] / n, 2) if n else None
+    out["kdf_ms_total"] = round(out["kdf_ms_total"], 1)
+    out["method"] = getattr(_hasher, "method", None) or type(_hasher).__name__
+    return out
+
+
+def _timed(key, fn, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        with _lock:
+            _stats[key] += 1
+            _stats["kdf_ms_total"] += (time.perf_counter() - started) * 1000
+
+
+def _run(key, fn, *args):
+    if _executor is None:
+        configure()
+    slots = _slots
+    if not slots.acquire(timeout=QUEUE_TIMEOUT):
+        with _lock:
+            _stats["busy"] += 1
+        raise HasherBusy("password hashing pool is saturated")
+    try:
+        future = _executor.submit(_timed, key, fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result()
+
+
+def _verifier(stored):
+    if _hasher is not None and _hasher.handles(stored):
+        return _hasher
+    return _legacy if _legacy.handles(stored) else make_hasher("argon2")
+
+
+# ---------------------------------------------------
+# API
+# ---------------------------------------------------
+def hash_password(password):
+    if _hasher is None:
+        configure()
+    return _run("hashed", _hasher.hash, password)
+
+
+def verify_password(stored, password):
+    if not stored or password is None:
+        return False
+    if _hasher is None:
+        configure()
+    return _run("verified", _verifier(stored).verify, stored, password)
+
+
+def needs_rehash(stored):
+    if _hasher is None:
+        configure()
+    return _hasher.needs_rehash(stored)
+
+
+def verify_and_update(user, password):
+    """
+    Check `password` against user.password_hash. On success, if the stored hash
+    uses an outdated scheme or cost, replace it (the caller commits).
+    """
+    if not verify_password(user.password_hash, password):
+        return False
+    if needs_rehash(user.password_hash):
+        user.password_hash = hash_password(password)
+        with _lock:
+            _stats["rehashed"] += 1
+    return True
+
+
+# ---------------------------------------------------
+# BENCHMARK:  python -m utils.passwords --bench [method ...]
+# ---------------------------------------------------
+BENCH_METHODS = [
+    "pbkdf2:sha256:260000",
+    "pbkdf2:sha256:600000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:65536:8:1",
+]
+
+
+def bench(methods, samples=5, concurrency=None, seconds=3.0):
+    """Single-call latency and pooled verify throughput for each method."""
+    concurrency = concurrency or DEFAULT_WORKERS
+    rows = []
+    for method in methods:
+        configure({"PASSWORD_HASH_METHOD": method, "PASSWORD_HASH_WORKERS": concurrency})
+        stored = hash_password("correct horse battery staple")
+
+        latencies = []
+        for _ in range(samples):
+            t = time.perf_counter()
+            verify_password(stored, "correct horse battery staple")
+            latencies.append((time.perf_counter() - t) * 1000)
+
+        done = 0
+        stop = time.perf_counter() + seconds
+        count_lock = threading.Lock()
+
+        def client():
+            nonlocal done
+            while time.perf_counter() < stop:
+                verify_password(stored, "wrong password")
+                with count_lock:
+                    done += 1
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency * 2)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        rows.append((method, statistics.median(latencies), max(latencies), done / elapsed))
+    return rows
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    methods = [a for a in sys.argv[1:] if not a.startswith("--")] or BENCH_METHODS
+    print(f"workers={DEFAULT_WORKERS} (cpu={os.cpu_count()})")
+    print(f"{'method':<24}{'p50 ms':>10}{'max ms':>10}{'verifies/s':>14}")
+    for method, p50, worst, rate in bench(methods):
+        print(f"{method:<24}{p50:>10.1f}{worst:>10.1f}{rate:>14.1f}")
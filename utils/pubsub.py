@@ -0,0 +1,58 @@
+import json
+import queue
+import threading
+
+# ---------------------------------------------------
+# IN-PROCESS PUB/SUB
+# ---------------------------------------------------
+# Topics are plain hashable keys, e.g. (date, slot, floor). Each subscriber gets
+# its own bounded queue; a subscriber that falls behind gets a single "resync"
+# message instead of blocking publishers.
+# Only subscribers in the same process see a message.
+SUBSCRIBER_QUEUE = 100
+
+_lock = threading.Lock()
+_subscribers = {}     # topic -> set of queue.Queue
+
+
+def subscribe(topic, limit=None):
+    """New subscriber queue for topic, or None if `limit` subscribers are already open."""
+    q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+    with _lock:
+        if limit is not None and sum(len(s) for s in _subscribers.values()) >= limit:
+            return None
+        _subscribers.setdefault(topic, set()).add(q)
+    return q
+
+
+def unsubscribe(topic, q):
+    with _lock:
+        subs = _subscribers.get(topic)
+        if subs:
+            subs.discard(q)
+            if not subs:
+                del _subscribers[topic]
+
+
+def publish(topic, message):
+    """Deliver message (a JSON-serialisable dict) to every subscriber of topic."""
+    with _lock:
+        subs = list(_subscribers.get(topic, ()))
+    if not subs:
+        return 0
+
+    data = json.dumps(message)
+    for q in subs:
+        try:
+            q.put_nowait(data)
+        except queue.Full:
+            # drop the backlog; the client reloads the full map instead
+            with q.mutex:
+                q.queue.clear()
+            q.put_nowait(json.dumps({"type": "resync"}))
+    return len(subs)
+
+
+def subscriber_count():
+    with _lock:
+        return sum(len(s) for s in _subscribers.values())
@@ -0,0 +1,88 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+# ---------------------------------------------------
+# SESSION RESUME PINS
+# ---------------------------------------------------
+# start_session issues a short numeric PIN, shown once in the workspace.
+# Only an HMAC of (user, booking, device, expiry, PIN) keyed with the app secret
+# is kept, in the signed session cookie, so resuming a paused session costs
+# one SHA-256 instead of a password KDF. The plain PIN is only ever in the
+# workspace page start_session renders. The PIN is tied to the device the
+# session was started on.
+# After MAX_FAILURES wrong PINs the PIN is locked and the password form
+# (resume_auth's fallback) is the only way back in; a correct password
+# unlocks the PIN again. Failure counters are per process.
+PIN_DIGITS = 6
+MAX_FAILURES = 5
+TTL = 4 * 3600            # seconds; capped further by the booking's slot end
+MAX_KEYS = 50000
+
+_lock = threading.Lock()
+_failures = {}            # (user_id, booking_id) -> wrong PINs since issue
+_stats = {"issued": 0, "ok": 0, "failed": 0, "locked": 0, "expired": 0}
+
+
+def stats():
+    with _lock:
+        return dict(_stats, tracked=len(_failures))
+
+
+def _mac(secret, user_id, booking_id, device_id, expires, pin):
+    key = hmac.new(secret.encode(), b"resume-pin", hashlib.sha256).digest()
+    msg = f"{user_id}|{booking_id}|{device_id}|{expires}|{pin}".encode()
+    return hmac.new(key, msg, hashlib.sha256).hexdigest()
+
+
+def issue(secret, user_id, booking_id, device_id, expires=None):
+    """
+    New PIN for a booking session. Returns (pin, ticket); store the ticket
+    in the session and show the PIN to the user once.
+    """
+    expires = int(min(expires or time.time() + TTL, time.time() + TTL))
+    pin = f"{secrets.randbelow(10 ** PIN_DIGITS):0{PIN_DIGITS}d}"
+    ticket = {"booking_id": booking_id, "expires": expires,
+              "mac": _mac(secret, user_id, booking_id, device_id, expires, pin)}
+    with _lock:
+        _failures.pop((user_id, booking_id), None)
+        _stats["issued"] += 1
+    return pin, ticket
+
+
+def verify(secret, ticket, user_id, booking_id, device_id, pin):
+    """Returns "ok", "invalid", "locked" or "expired"."""
+    if not ticket or ticket.get("booking_id") != booking_id:
+        return "invalid"
+    key = (user_id, booking_id)
+
+    with _lock:
+        if _failures.get(key, 0) >= MAX_FAILURES:
+            _stats["locked"] += 1
+            return "locked"
+    if time.time() > ticket.get("expires", 0):
+        with _lock:
+            _stats["expired"] += 1
+        return "expired"
+
+    expected = _mac(secret, user_id, booking_id, device_id, ticket["expires"], (pin or "").strip())
+    if hmac.compare_digest(expected, ticket.get("mac", "")):
+        with _lock:
+            _failures.pop(key, None)
+            _stats["ok"] += 1
+        return "ok"
+
+    with _lock:
+        if key not in _failures and len(_failures) >= MAX_KEYS:
+            _failures.clear()
+        _failures[key] = _failures.get(key, 0) + 1
+        _stats["failed"] += 1
+        return "locked" if _failures[key] >= MAX_FAILURES else "invalid"
+
+
+def reset(user_id, booking_id):
+    """Clear the failure count (after a successful password resume)."""
+    with _lock:
+        _failures.pop((user_id, booking_id), None)
@@ -0,0 +1,197 @@
+import ipaddress
+import time
+from sqlalchemy import update
+from models import db, Device, OFFICE_TZ
+
+try:
+    import numpy as np
+except ImportError:   # optional: the batch path falls back to plain Python
+    np = None
+
+# ---------------------------------------------------
+# DEVICE RISK SCORING
+# ---------------------------------------------------
+# A device's score is the sum of the weights of the rules it trips, clipped
+# to 0..100. Each rule looks at one or more Device attributes.
+# Override weights with app.config["RISK_WEIGHTS"] = {"rule_name": weight}
+# (0 disables a rule), then rescore everything with `flask --app app rescore-devices`.
+#
+# rescore_all() reads only the scored columns and evaluates each rule once per
+# distinct attribute value, not once per row (user agents, platforms, screens ...
+# repeat heavily). It then gathers a 0/1 hit matrix and does one matrix-vector
+# product, and writes back only the changed scores as a single executemany UPDATE.
+MAX_SCORE = 100
+BATCH_SIZE = 5000
+
+DESKTOP_PLATFORMS = ("win", "mac", "linux", "x11", "cros")
+KNOWN_PLATFORMS = DESKTOP_PLATFORMS + ("android", "iphone", "ipad", "ipod", "ios")
+AUTOMATION_UA = ("headless", "phantomjs", "selenium", "webdriver", "puppeteer", "playwright",
+                 "python-requests", "curl/", "wget/", "httpclient", "okhttp")
+SLOW_CONNECTIONS = ("slow-2g", "2g")
+
+
+def _text(v):
+    return (str(v) if v is not None else "").strip().lower()
+
+
+def _screen_ok(v):
+    try:
+        w, h = (int(x) for x in _text(v).split("x"))
+        return w >= 320 and h >= 320
+    except ValueError:
+        return False
+
+
+def _public_ip(v):
+    try:
+        ip = ipaddress.ip_address(_text(v))
+    except ValueError:
+        return False
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local)
+
+
+def _memory_gb(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# (name, attributes, weight, test(*values) -> bool)
+RULES = [
+    ("ua_missing",          ("user_agent",), 25, lambda ua: not _text(ua)),
+    ("ua_automation",       ("user_agent",), 40, lambda ua: any(s in _text(ua) for s in AUTOMATION_UA)),
+    ("platform_missing",    ("platform",), 10, lambda p: not _text(p)),
+    ("platform_unknown",    ("platform",), 10,
+     lambda p: bool(_text(p)) and not any(k in _text(p) for k in KNOWN_PLATFORMS)),
+    ("ua_platform_mismatch", ("user_agent", "platform"), 15,
+     lambda ua, p: ("android" in _text(ua) or "iphone" in _text(ua))
+     and any(k in _text(p) for k in ("win", "mac"))),
+    ("screen_unusual",      ("screen",), 10, lambda s: not _screen_ok(s)),
+    ("timezone_unstable",   ("timezone",), 15, lambda tz: _text(tz) in ("", "utc", "etc/utc", "gmt")),
+    ("timezone_offsite",    ("timezone",), 5,
+     lambda tz: _text(tz) not in ("", "utc", "etc/utc", "gmt", OFFICE_TZ.lower())),
+    ("ip_missing",          ("ip_address",), 5, lambda ip: not _text(ip)),
+    ("ip_public",           ("ip_address",), 10, lambda ip: _public_ip(ip)),
+    ("battery_unknown",     ("battery",), 5, lambda b: _text(b) in ("", "unknown")),
+    ("connection_unknown",  ("connection_type",), 5, lambda c: _text(c) in ("", "unknown")),
+    ("connection_slow",     ("connection_type",), 5, lambda c: _text(c) in SLOW_CONNECTIONS),
+    ("touch_on_desktop",    ("touch_support", "platform"), 5,
+     lambda t, p: bool(t) and any(k in _text(p) for k in DESKTOP_PLATFORMS)),
+    ("memory_low",          ("device_memory",), 5,
+     lambda m: _memory_gb(m) is not None and _memory_gb(m) < 2),
+]
+
+ATTRIBUTES = sorted({a for _, attrs, _, _ in RULES for a in attrs})
+
+
+def weights(config=None):
+    """Rule weights in RULES order, with app.config["RISK_WEIGHTS"] applied."""
+    overrides = (config or {}).get("RISK_WEIGHTS") or {}
+    return [overrides.get(name, weight) for name, _, weight, _ in RULES]
+
+
+def features_from_payload(payload, ip=None):
+    """Device attribute dict from a registration payload / login form."""
+    return dict(client_hints(payload),
+                user_agent=payload.get("userAgent"),
+                platform=payload.get("platform"),
+                screen=payload.get("screen"),
+                timezone=payload.get("timezone"),
+                ip_address=ip)
+
+
+def _flag(v):
+    return v in (True, 1) or _text(v) in ("1", "true", "on", "yes")
+
+
+def client_hints(payload):
+    """Device column values for the optional browser hints (battery, touch, ...)."""
+    memory = payload.get("deviceMemory")
+    return {
+        "battery": (str(payload["battery"])[:20] if payload.get("battery") not in (None, "") else None),
+        "charging": _flag(payload.get("charging")),
+        "touch_support": _flag(payload.get("touch")),
+        "device_memory": str(memory)[:20] if memory not in (None, "") else None,
+        "connection_type": (str(payload["connection"])[:50] if payload.get("connection") else None),
+    }
+
+
+def explain(features, config=None):
+    """[(rule name, weight)] for every rule the device trips."""
+    out = []
+    for (name, attrs, _, test), weight in zip(RULES, weights(config)):
+        if weight and test(*(features.get(a) for a in attrs)):
+            out.append((name, weight))
+    return out
+
+
+def score(features, config=None):
+    return max(0, min(MAX_SCORE, sum(w for _, w in explain(features, config))))
+
+
+def risk_score_from(payload, ip=None, config=None):
+    return score(features_from_payload(payload, ip), config)
+
+
+# ---------------------------------------------------
+# BATCH RESCORE
+# ---------------------------------------------------
+def _hit_columns(rows, index):
+    """Per rule: a list of 0/1 hits for `rows`, evaluating the test once per distinct value."""
+    columns = []
+    for _, attrs, _, test in RULES:
+        cols = [index[a] for a in attrs]
+        memo = {}
+        hits = []
+        for row in rows:
+            key = tuple(row[c] for c in cols)
+            hit = memo.get(key)
+            if hit is None:
+                hit = memo[key] = 1 if test(*key) else 0
+            hits.append(hit)
+        columns.append(hits)
+    return columns
+
+
+def score_rows(rows, index, w):
+    """Scores for rows of attribute tuples (`index` maps attribute -> position)."""
+    columns = _hit_columns(rows, index)
+    if np is not None:
+        hits = np.array(columns, dtype=np.int16).T          # rows x rules
+        return np.clip(hits @ np.asarray(w, dtype=np.int32), 0, MAX_SCORE).tolist()
+    return [max(0, min(MAX_SCORE, sum(h * wt for h, wt in zip(hit_row, w))))
+            for hit_row in zip(*columns)]
+
+
+def rescore_all(config=None):
+    """
+    Recompute risk_score for every device; writes only changed rows.
+    Returns {"devices", "changed", "seconds"}. Needs an app context.
+    """
+    started = time.perf_counter()
+    w = weights(config)
+    cols = [getattr(Device, a) for a in ATTRIBUTES]
+    index = {a: i for i, a in enumerate(ATTRIBUTES)}
+    total = changed = 0
+    last_id = 0
+
+    while True:
+        batch = db.session.query(Device.id, Device.risk_score, *cols) \
+                          .filter(Device.id > last_id) \
+                          .order_by(Device.id).limit(BATCH_SIZE).all()
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        scores = score_rows([r[2:] for r in batch], index, w)
+        updates = [{"id": r[0], "risk_score": int(s)} for r, s in zip(batch, scores) if r[1] != s]
+        if updates:
+            db.session.execute(update(Device), updates)
+            db.session.commit()
+
+        total += len(batch)
+        changed += len(updates)
+
+    return {"devices": total, "changed": changed,
+            "seconds": round(time.perf_counter() - started, 3)}
@@ -0,0 +1,259 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import Counter
+from models import db, Device
+
+# ---------------------------------------------------
+# DEVICE SIMILARITY INDEX (MinHash + LSH)
+# ---------------------------------------------------
+# A device is described by a set of feature tokens (UA products and words,
+# platform, screen, timezone, CPU threads, memory, touch). Its MinHash
+# signature (NUM_PERM 32-bit values, hex in Device.fp_signature) estimates
+# Jaccard similarity between two token sets. A browser upgrade or a timezone
+# change only swaps a token or two, so the drifted device still scores ~0.9
+# against its old record, while the exact SHA-256 fingerprint changes entirely.
+#
+# Signatures are split into BANDS bands of ROWS values. Devices sharing any band
+# are candidates (LSH). The MAX_COMPARE candidates sharing the most bands are
+# compared signature against signature, and the best one at or above the
+# threshold is the match.
+# A user's devices are loaded on first lookup (one indexed query) and kept for
+# TTL seconds. Writes in this process update the index straight away; other
+# processes' new devices show up after TTL.
+# app.config["DEVICE_MATCH_THRESHOLD"] overrides THRESHOLD.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.8
+TTL = 60                  # seconds
+MAX_USERS = 10000
+MAX_COMPARE = 16          # full signature comparisons per lookup
+
+_PRIME = (1 << 61) - 1
+_MASK = 0xFFFFFFFF
+_rng = random.Random(20240601)          # fixed: signatures must match across processes and restarts
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_lock = threading.Lock()
+_buckets = {}             # (user_id, band, band values) -> {device_id}
+_signatures = {}          # device_id -> (user_id, signature tuple)
+_loaded = {}              # user_id -> expires (monotonic)
+_stats = {"lookups": 0, "matches": 0, "candidates": 0, "user_loads": 0, "lookup_us_total": 0.0}
+
+
+# ---------------------------------------------------
+# FEATURES / SIGNATURES
+# ---------------------------------------------------
+def features(user_agent=None, platform=None, screen=None, timezone=None,
+             cpu_threads=None, device_memory=None, touch=None):
+    """Token set describing a device; empty when nothing usable was sent."""
+    tokens = set()
+    ua = (user_agent or "").lower()
+    for part in re.split(r"[\s;(),]+", ua):
+        if not part:
+            continue
+        name, _, version = part.partition("/")
+        tokens.add(f"ua:{name}")
+        if version:
+            tokens.add(f"ua:{name}/{version.split('.')[0]}")
+
+    pf = (platform or "").lower()
+    if "android" in ua:
+        pf = "android"
+    if "iphone" in ua or "ios" in ua:
+        pf = "ios"
+    if pf:
+        tokens.add(f"pf:{pf}")
+
+    try:
+        w, h = sorted(int(x) for x in (screen or "").lower().split("x"))
+        tokens.add(f"scr:{w}x{h}")
+        tokens.add(f"ratio:{round(h / w, 2)}")
+    except (ValueError, ZeroDivisionError):
+        pass
+
+    tz = (timezone or "").strip()
+    if tz.upper() in ("", "UTC", "ETC/UTC", "GMT"):
+        tz = "unstable"
+    tokens.add(f"tz:{tz}")
+    tokens.add(f"tzr:{tz.split('/')[0]}")
+
+    if cpu_threads not in (None, ""):
+        tokens.add(f"cpu:{cpu_threads}")
+    if device_memory not in (None, ""):
+        tokens.add(f"mem:{device_memory}")
+    if touch is not None:
+        tokens.add(f"touch:{1 if touch else 0}")
+
+    return tokens if (ua or pf) else set()
+
+
+def features_from_payload(payload):
+    return features(payload.get("userAgent"), payload.get("platform"), payload.get("screen"),
+                    payload.get("timezone"), payload.get("cpuThreads"), payload.get("deviceMemory"),
+                    payload.get("touch"))
+
+
+def features_from_device(d):
+    return features(d.user_agent, d.platform, d.screen, d.timezone,
+                    d.cpu_threads, d.device_memory, d.touch_support)
+
+
+def signature(tokens):
+    """MinHash signature (tuple of NUM_PERM ints) of a token set, or None if empty."""
+    if not tokens:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), "big")
+              for t in tokens]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) & _MASK for a, b in _PERMS)
+
+
+def encode(sig):
+    return "".join(f"{v:08x}" for v in sig) if sig else None
+
+
+def decode(text):
+    if not text or len(text) != NUM_PERM * 8:
+        return None
+    return tuple(int(text[i:i + 8], 16) for i in range(0, len(text), 8))
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+# ---------------------------------------------------
+# INDEX
+# ---------------------------------------------------
+def _bands(sig):
+    return [(i, sig[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+
+def _insert(device_id, user_id, sig):
+    _discard(device_id)
+    _signatures[device_id] = (user_id, sig)
+    for band, values in _bands(sig):
+        _buckets.setdefault((user_id, band, values), set()).add(device_id)
+
+
+def _discard(device_id):
+    old = _signatures.pop(device_id, None)
+    if old is None:
+        return
+    user_id, sig = old
+    for band, values in _bands(sig):
+        key = (user_id, band, values)
+        ids = _buckets.get(key)
+        if ids is not None:
+            ids.discard(device_id)
+            if not ids:
+                del _buckets[key]
+
+
+def _forget(user_id):
+    _loaded.pop(user_id, None)
+    for device_id in [d for d, (u, _) in _signatures.items() if u == user_id]:
+        _discard(device_id)
+
+
+def _ensure_loaded(user_id):
+    now = time.monotonic()
+    with _lock:
+        if _loaded.get(user_id, 0) > now:
+            return
+    rows = db.session.query(Device.id, Device.fp_signature).filter(Device.user_id == user_id).all()
+    with _lock:
+        if len(_loaded) >= MAX_USERS:
+            _buckets.clear()
+            _signatures.clear()
+            _loaded.clear()
+        _forget(user_id)
+        for device_id, text in rows:
+            sig = decode(text)
+            if sig is not None:
+                _insert(device_id, user_id, sig)
+        _loaded[user_id] = now + TTL
+        _stats["user_loads"] += 1
+
+
+def nearest(user_id, sig, threshold=THRESHOLD):
+    """(device_id, similarity) of the user's closest device at or above threshold, else None."""
+    if sig is None:
+        return None
+    _ensure_loaded(user_id)
+    started = time.perf_counter()
+    with _lock:
+        candidates = Counter()
+        for band, values in _bands(sig):
+            candidates.update(_buckets.get((user_id, band, values), ()))
+        best = None
+        for device_id, _ in candidates.most_common(MAX_COMPARE):
+            score = similarity(sig, _signatures[device_id][1])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (device_id, score)
+        _stats["lookups"] += 1
+        _stats["candidates"] += len(candidates)
+        _stats["matches"] += best is not None
+        _stats["lookup_us_total"] += (time.perf_counter() - started) * 1e6
+    return best
+
+
+def find_device(user_id, sig, config=None):
+    """(Device, similarity) for the user's nearest device, or (None, None)."""
+    threshold = (config or {}).get("DEVICE_MATCH_THRESHOLD") or THRESHOLD
+    match = nearest(user_id, sig, threshold)
+    if match is None:
+        return None, None
+    device = db.session.get(Device, match[0])
+    if device is None or device.user_id != user_id:    # deleted or reassigned in another process
+        remove(match[0])
+        return None, None
+    return device, match[1]
+
+
+def add(device_id, user_id, sig):
+    """Index a device after its fp_signature was committed."""
+    if sig is None:
+        return
+    with _lock:
+        if user_id in _loaded:
+            _insert(device_id, user_id, sig)
+
+
+def remove(device_id):
+    with _lock:
+        _discard(device_id)
+
+
+def forget_user(user_id):
+    with _lock:
+        _forget(user_id)
+
+
+def stats():
+    with _lock:
+        out = dict(_stats, users=len(_loaded), devices=len(_signatures))
+    out["lookup_us_avg"] = round(out["lookup_us_total"] / out["lookups"], 1) if out["lookups"] else None
+    out["lookup_us_total"] = round(out["lookup_us_total"], 1)
+    return out
+
+
+# ---------------------------------------------------
+# BACKFILL (migration 10)
+# ---------------------------------------------------
+def backfill(batch=1000):
+    """Compute fp_signature for devices that don't have one yet."""
+    last_id = 0
+    while True:
+        devices = Device.query.filter(Device.id > last_id, Device.fp_signature.is_(None)) \
+                              .order_by(Device.id).limit(batch).all()
+        if not devices:
+            break
+        for d in devices:
+            d.fp_signature = encode(signature(features_from_device(d)))
+        last_id = devices[-1].id
+        db.session.flush()
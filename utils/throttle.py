@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+
+try:
+    import redis
+except ImportError:   # optional: pip install redis
+    redis = None
+
+# ---------------------------------------------------
+# LOGIN THROTTLING
+# ---------------------------------------------------
+# Failed logins are tracked in a sliding WINDOW under two keys:
+#   (IP, username)  more than FREE_PER_PAIR failures blocks that pair only, so
+#                   one person's typos never lock out colleagues behind the same
+#                   office NAT address, and a remote attacker can't lock out a
+#                   username they don't share an address with;
+#   IP              blocked only once its failures span more than
+#                   FREE_USERNAMES_PER_IP distinct usernames (password spraying).
+# A blocked key waits BACKOFF_BASE seconds, doubling with every further failure,
+# up to BACKOFF_MAX. check() runs before the user lookup and the password hash,
+# so a throttled attempt costs neither a query nor a KDF.
+# Behind a reverse proxy, set TRUSTED_PROXIES so the client address is real
+# (see app.create_app); otherwise every request shares the proxy's address.
+#
+# State is kept in process by default. Set app.config["THROTTLE_REDIS_URL"]
+# (needs the redis package) to share it between workers.
+WINDOW = 15 * 60          # seconds
+FREE_PER_PAIR = 5         # failures per (IP, username) before backoff starts
+FREE_USERNAMES_PER_IP = 30  # distinct failing usernames per IP before the IP is blocked
+BACKOFF_BASE = 2          # seconds
+BACKOFF_MAX = 15 * 60
+MAX_KEYS = 50000
+
+_lock = threading.Lock()
+_stats = {"checked": 0, "throttled": 0, "failures": 0, "cleared": 0}
+
+
+def _backoff(failures, free):
+    over = failures - free
+    if over <= 0:
+        return 0
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (over - 1))
+
+
+class MemoryStore:
+    """key -> [deque of (failure time, member), blocked_until]"""
+
+    def __init__(self):
+        self._keys = {}
+
+    def blocked_for(self, key, now):
+        with _lock:
+            entry = self._keys.get(key)
+            return max(0.0, entry[1] - now) if entry else 0.0
+
+    def fail(self, key, free, now, member=None):
+        """Count a failure; with `member`, the count is distinct members in the window."""
+        with _lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                if len(self._keys) >= MAX_KEYS:
+                    self._prune(now)
+                entry = self._keys[key] = [deque(), 0.0]
+            times = entry[0]
+            times.append((now, member))
+            while times and times[0][0] <= now - WINDOW:
+                times.popleft()
+            count = len({m for _, m in times}) if member is not None else len(times)
+            delay = _backoff(count, free)
+            if delay:
+                entry[1] = now + delay
+            return delay
+
+    def clear(self, key):
+        with _lock:
+            self._keys.pop(key, None)
+
+    def size(self):
+        with _lock:
+            return len(self._keys)
+
+    def _prune(self, now):
+        for k in [k for k, (times, until) in self._keys.items()
+                  if until <= now and (not times or times[-1][0] <= now - WINDOW)]:
+            del self._keys[k]
+        if len(self._keys) >= MAX_KEYS:
+            self._keys.clear()
+
+
+class RedisStore:
+    """Same state in Redis: a sorted set of failure times plus a blocked-until key."""
+
+    def __init__(self, url):
+        self._r = redis.Redis.from_url(url)
+
+    def blocked_for(self, key, now):
+        until = self._r.get(f"throttle:block:{key}")
+        return max(0.0, float(until) - now) if until else 0.0
+
+    def fail(self, key, free, now, member=None):
+        zkey = f"throttle:fail:{key}"
+        pipe = self._r.pipeline()
+        # sorted-set members are unique, so a member-keyed count is distinct members
+        pipe.zadd(zkey, {member if member is not None else repr(now): now})
+        pipe.zremrangebyscore(zkey, 0, now - WINDOW)
+        pipe.zcard(zkey)
+        pipe.expire(zkey, WINDOW)
+        count = pipe.execute()[2]
+        delay = _backoff(count, free)
+        if delay:
+            self._r.set(f"throttle:block:{key}", now + delay, ex=int(delay) + 1)
+        return delay
+
+    def clear(self, key):
+        self._r.delete(f"throttle:fail:{key}", f"throttle:block:{key}")
+
+    def size(self):
+        return None
+
+
+_store = MemoryStore()
+
+
+def configure(config=None):
+    global _store
+    url = (config or {}).get("THROTTLE_REDIS_URL")
+    if url:
+        if redis is None:
+            raise RuntimeError("THROTTLE_REDIS_URL needs the redis package")
+        _store = RedisStore(url)
+    else:
+        _store = MemoryStore()
+
+
+def _keys(ip, username):
+    """[(key, free failures, member)]: distinct usernames per IP, plain count per pair."""
+    ip = ip or "-"
+    user = (username or "").lower()
+    return [(f"ip:{ip}", FREE_USERNAMES_PER_IP, user), (f"pair:{ip}|{user}", FREE_PER_PAIR, None)]
+
+
+def check(ip, username):
+    """Seconds the caller must wait before another login attempt (0 = go ahead)."""
+    now = time.time()
+    wait = max(_store.blocked_for(key, now) for key, _, _ in _keys(ip, username))
+    with _lock:
+        _stats["checked"] += 1
+        if wait:
+            _stats["throttled"] += 1
+    return wait
+
+
+def failure(ip, username):
+    """Record a failed attempt; returns the backoff now in force (seconds)."""
+    now = time.time()
+    with _lock:
+        _stats["failures"] += 1
+    return max(_store.fail(key, free, now, member) for key, free, member in _keys(ip, username))
+
+
+def success(ip, username):
+    """A correct password clears the (IP, username) record (the IP's stays)."""
+    _store.clear(_keys(ip, username)[1][0])
+    with _lock:
+        _stats["cleared"] += 1
+
+
+def stats():
+    with _lock:
+        out = dict(_stats)
+    out["tracked_keys"] = _store.size()
+    out["store"] = type(_store).__name__
+    return out
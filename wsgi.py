@@ -0,0 +1,19 @@
+# ---------------------------------------------------
+# WSGI ENTRY POINT
+# ---------------------------------------------------
+#   gunicorn -w 4 --threads 8 -b 0.0.0.0:8000 wsgi:app
+#   waitress-serve --threads=16 --listen=0.0.0.0:8000 wsgi:app
+#
+# Run `flask --app wsgi init-db` (and `create-admin`) once before starting workers.
+# Every worker runs the booking sweeper; its UPDATEs are status-guarded, so
+# that is safe. BOOKING_LIFECYCLE=0 turns it off.
+#
+# Live floor updates (/booking/api/stream) hold one worker thread per open page.
+# With sync/threaded workers keep STREAM_MAX_OPEN (default 4 per process) well
+# below the thread count; pages over the cap poll instead of streaming. With an
+# async worker class (gunicorn -k gevent) streams are cheap, so raise
+# STREAM_MAX_OPEN and STREAM_MAX_SECONDS:
+#   STREAM_MAX_OPEN=500 STREAM_MAX_SECONDS=300 gunicorn -k gevent -w 4 -b 0.0.0.0:8000 wsgi:app
+from app import create_app
+
+app = create_app()